@@ -2,6 +2,7 @@
 from fastapi import FastAPI, File, UploadFile, Form, Depends, HTTPException, Request, BackgroundTasks
 from fastapi.responses import JSONResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 import os
 import logging
 import shutil
@@ -39,7 +40,7 @@ os.makedirs(OCR_TEMP_FOLDER, exist_ok=True)
 
 # OCR処理インポート
 try:
-    from ocr_service import process_document, extract_po_data, process_po_file
+    from ocr_service import process_document, extract_po_data_cached, process_po_file, write_uploaded_file, OCR_CONCURRENCY
     logger.info("OCRサービスモジュールをインポートしました")
 except ImportError as e:
     logger.error(f"OCRモジュールのインポートエラー: {str(e)}")
@@ -60,6 +61,9 @@ app.add_middleware(
 # 処理状態を保存する辞書
 jobs_status = {}
 
+# 同時に実行するOCR処理の上限（BackgroundTasksのスレッドプールでCPUを奪い合わないように）
+ocr_semaphore = threading.BoundedSemaphore(OCR_CONCURRENCY)
+
 @app.get("/")
 async def root():
     """
@@ -111,14 +115,17 @@ async def debug_status():
     """
     logger.info("デバッグステータスエンドポイントにアクセスがありました")
     
-    # テストファイルの作成を試みる
+    # テストファイルの作成を試みる（作成できれば読み書き可能と判断する）
     test_file_path = os.path.join(UPLOAD_FOLDER, "test.txt")
     test_success = False
     try:
-        with open(test_file_path, "w") as f:
-            f.write("テスト")
+        fd = os.open(test_file_path, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o600)
+        try:
+            os.write(fd, "テスト".encode("utf-8"))
+        finally:
+            os.close(fd)
         test_success = True
-        os.remove(test_file_path)
+        os.unlink(test_file_path)
     except Exception as e:
         logger.error(f"テストファイル作成エラー: {str(e)}")
     
@@ -211,15 +218,16 @@ def process_file_background(file_path: str, job_id: str):
         
         # OCR処理
         try:
-            # テキスト抽出
-            ocr_text = process_document(file_path)
+            # テキスト抽出（同時実行数を制限）
+            with ocr_semaphore:
+                ocr_text = process_document(file_path)
             
             # テキストが短すぎる場合はエラー
             if not ocr_text or len(ocr_text) < 50:
                 raise Exception("OCRテキストが短すぎます")
                 
             # PO情報の抽出
-            po_data = extract_po_data(ocr_text)
+            po_data = extract_po_data_cached(ocr_text)
             
             # フィールド名の調整（フロントエンドとの互換性確保）
             if "products" in po_data:
@@ -306,9 +314,9 @@ async def upload_file(
         filename = f"{file_id}_{file.filename}"
         file_path = os.path.join(UPLOAD_FOLDER, filename)
         
-        # ファイルを保存
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # ファイルを保存（OCRキャッシュ用のハッシュも同時に計算）
+        # 同期I/Oでイベントループを止めないようスレッドプールで実行する
+        await run_in_threadpool(write_uploaded_file, file, file_path)
         
         logger.info(f"ファイルを保存しました: {file_path}")
         
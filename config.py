@@ -26,6 +26,18 @@ ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "1440
 UPLOAD_FOLDER = "/tmp"
 OCR_TEMP_FOLDER = "/tmp"
 
+# PDFをOCRする際の標準解像度（細かい文字が多い場合は環境変数で引き上げる）
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))
+
+# 1ワーカーで同時にOCR処理するドキュメント数（ドキュメント内のページ処理はCPU数をこの値で割った並列数で行う）
+OCR_CONCURRENCY = max(1, int(os.getenv("OCR_CONCURRENCY", "2")))
+
+# OCRエンジン（"tesseract" または "paddle"。paddleで抽出できない場合はtesseractで処理）
+OCR_ENGINE = os.getenv("OCR_ENGINE", "tesseract").lower()
+
+# OCRキャッシュ用Redis接続URL（未設定の場合はファイルキャッシュを使用）
+REDIS_URL = os.getenv("REDIS_URL")
+
 # 開発モード設定
 DEV_MODE = os.getenv("DEV_MODE", "False").lower() in ("true", "1", "t")
 
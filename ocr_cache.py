@@ -0,0 +1,278 @@
+"""
+OCR結果をハッシュ（SHA-256）で保存するキャッシュモジュール
+
+OCRテキストはファイル内容のハッシュ、POデータは抽出元のOCRテキストのハッシュをキーにする。
+
+同一ファイルの再アップロードやリトライ時にOCR処理とPOデータ抽出を省略するために使用する。
+REDIS_URLが設定されていればRedis、なければOCR_TEMP_FOLDER配下のファイルに保存する。
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+import orjson
+
+from config import OCR_TEMP_FOLDER, REDIS_URL, OCR_DPI
+from ocr_extractors import EXTRACTOR_VERSION
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# キャッシュの保存先と容量・有効期限の設定
+OCR_CACHE_DIR = os.path.join(OCR_TEMP_FOLDER, "ocr_cache")
+OCR_CACHE_TTL = 30 * 24 * 60 * 60  # 秒
+OCR_CACHE_MAX_ENTRIES = 1000
+
+# OCRテキストのキャッシュ形式のバージョン（前処理やOCR設定を変更したら上げる）
+OCR_TEXT_CACHE_VERSION = 1
+
+# キャッシュキーの接頭辞（設定や処理の変更後に古い結果を返さないよう、
+# OCRテキストはテキストを抽出したエンジン・解像度・バージョンを、POデータは抽出ロジックのバージョンを含める）
+OCR_TEXT_PREFIX = "ocr:{engine}:dpi{dpi}:v{version}"
+PO_DATA_PREFIX = f"po:v{EXTRACTOR_VERSION}"
+
+# ハッシュ計算時の読み込みサイズ
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# 計算済みのハッシュ（(ファイルパス, サイズ, 更新時刻) → ハッシュ）
+_KNOWN_FILE_HASHES_MAX = 256
+_known_file_hashes: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+_known_file_hashes_lock = threading.Lock()
+
+
+def _create_redis_client():
+    """REDIS_URLが設定されていればRedisクライアントを作成する"""
+    if not REDIS_URL:
+        return None
+    if redis is None:
+        logger.warning("REDIS_URLが設定されていますがredisパッケージがありません。ファイルキャッシュを使用します")
+        return None
+    try:
+        return redis.Redis.from_url(REDIS_URL)
+    except Exception as e:
+        logger.warning(f"Redisクライアントの作成に失敗しました。ファイルキャッシュを使用します: {str(e)}")
+        return None
+
+
+_redis_client = _create_redis_client()
+
+
+def new_hasher():
+    """キャッシュキーの計算に使用するハッシュオブジェクトを返す"""
+    return hashlib.sha256()
+
+
+def _file_stat_key(file_path: str) -> Tuple[str, int, int]:
+    """ファイルの内容が変わればキーも変わるよう、パスにサイズと更新時刻を組み合わせる"""
+    st = os.stat(file_path)
+    return (file_path, st.st_size, st.st_mtime_ns)
+
+
+def remember_file_hash(file_path: str, file_hash: str):
+    """
+    計算したハッシュを記録する（同じファイルでの再計算を省略するため）
+
+    Args:
+        file_path: ファイルのパス
+        file_hash: ファイル内容のハッシュ
+    """
+    _remember_hash(_file_stat_key(file_path), file_hash)
+
+
+def _remember_hash(key: Tuple[str, int, int], file_hash: str):
+    with _known_file_hashes_lock:
+        _known_file_hashes[key] = file_hash
+        _known_file_hashes.move_to_end(key)
+        if len(_known_file_hashes) > _KNOWN_FILE_HASHES_MAX:
+            _known_file_hashes.popitem(last=False)
+
+
+def compute_file_hash(file_path: str) -> str:
+    """
+    ファイル内容のハッシュを返す（記録済みであればそれを使用）
+
+    Args:
+        file_path: ファイルのパス
+
+    Returns:
+        ファイル内容のハッシュ（16進文字列）
+    """
+    key = _file_stat_key(file_path)
+    with _known_file_hashes_lock:
+        known = _known_file_hashes.get(key)
+    if known is not None:
+        return known
+
+    hasher = new_hasher()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    file_hash = hasher.hexdigest()
+    _remember_hash(key, file_hash)
+    return file_hash
+
+
+def hash_text(text: str) -> str:
+    """
+    テキストのハッシュを返す（POデータのキャッシュキーに使用）
+
+    Args:
+        text: OCRで抽出されたテキスト
+
+    Returns:
+        テキストのハッシュ（16進文字列）
+    """
+    hasher = new_hasher()
+    hasher.update(text.encode("utf-8"))
+    return hasher.hexdigest()
+
+
+def _ocr_text_prefix(engine: str) -> str:
+    return OCR_TEXT_PREFIX.format(engine=engine, dpi=OCR_DPI, version=OCR_TEXT_CACHE_VERSION)
+
+
+def get(file_hash: str, engine: str) -> Optional[str]:
+    """
+    キャッシュ済みのOCRテキストを取得する
+
+    Args:
+        file_hash: ファイル内容のハッシュ
+        engine: テキストを抽出したOCRエンジン（'tesseract' または 'paddle'）
+
+    Returns:
+        キャッシュ済みのテキスト（存在しないか期限切れの場合はNone）
+    """
+    value = _get_bytes(_ocr_text_prefix(engine), file_hash)
+    return value.decode("utf-8") if value is not None else None
+
+
+def put(file_hash: str, raw_text: str, engine: str):
+    """
+    OCRテキストをキャッシュに保存する
+
+    Args:
+        file_hash: ファイル内容のハッシュ
+        raw_text: 抽出されたテキスト
+        engine: テキストを抽出したOCRエンジン（'tesseract' または 'paddle'）
+    """
+    _put_bytes(_ocr_text_prefix(engine), file_hash, raw_text.encode("utf-8"))
+
+
+def get_po_data(text_hash: str) -> Optional[Dict[str, Any]]:
+    """
+    キャッシュ済みのPOデータ抽出結果を取得する
+
+    Args:
+        text_hash: 抽出元のOCRテキストのハッシュ（hash_textの戻り値）
+
+    Returns:
+        キャッシュ済みのPOデータ（存在しないか期限切れの場合はNone）
+    """
+    value = _get_bytes(PO_DATA_PREFIX, text_hash)
+    if value is None:
+        return None
+    try:
+        return orjson.loads(value)
+    except orjson.JSONDecodeError as e:
+        logger.warning(f"POデータキャッシュの解析に失敗: {str(e)}")
+        return None
+
+
+def put_po_data(text_hash: str, po_data: Dict[str, Any]):
+    """
+    POデータ抽出結果をキャッシュに保存する
+
+    Args:
+        text_hash: 抽出元のOCRテキストのハッシュ（hash_textの戻り値）
+        po_data: 抽出されたPOデータ
+    """
+    try:
+        value = orjson.dumps(po_data)
+    except TypeError as e:
+        logger.warning(f"POデータのキャッシュ用JSON変換に失敗: {str(e)}")
+        return
+    _put_bytes(PO_DATA_PREFIX, text_hash, value)
+
+
+def _get_bytes(prefix: str, digest: str) -> Optional[bytes]:
+    if _redis_client is not None:
+        try:
+            return _redis_client.get(f"{prefix}:{digest}")
+        except Exception as e:
+            logger.warning(f"Redisキャッシュの読み込みに失敗: {str(e)}")
+            return None
+
+    path = _entry_path(prefix, digest)
+    try:
+        if time.time() - os.path.getmtime(path) > OCR_CACHE_TTL:
+            os.unlink(path)
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"OCRキャッシュの読み込みに失敗: {str(e)}")
+        return None
+
+
+def _put_bytes(prefix: str, digest: str, value: bytes):
+    if _redis_client is not None:
+        try:
+            _redis_client.setex(f"{prefix}:{digest}", OCR_CACHE_TTL, value)
+        except Exception as e:
+            logger.warning(f"Redisキャッシュの保存に失敗: {str(e)}")
+        return
+
+    try:
+        os.makedirs(OCR_CACHE_DIR, exist_ok=True)
+        path = _entry_path(prefix, digest)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(value)
+        os.replace(tmp_path, path)
+        _evict()
+    except Exception as e:
+        logger.warning(f"OCRキャッシュの保存に失敗: {str(e)}")
+
+
+def _entry_path(prefix: str, digest: str) -> str:
+    return os.path.join(OCR_CACHE_DIR, f"{prefix.replace(':', '_')}_{digest}.cache")
+
+
+def _evict():
+    """期限切れのエントリと、上限を超えた古いエントリを削除する"""
+    entries = []
+    now = time.time()
+    with os.scandir(OCR_CACHE_DIR) as it:
+        for entry in it:
+            if not entry.name.endswith(".cache"):
+                continue
+            try:
+                mtime = entry.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            if now - mtime > OCR_CACHE_TTL:
+                _unlink_quietly(entry.path)
+            else:
+                entries.append((mtime, entry.path))
+
+    if len(entries) > OCR_CACHE_MAX_ENTRIES:
+        entries.sort()
+        for _, path in entries[:len(entries) - OCR_CACHE_MAX_ENTRIES]:
+            _unlink_quietly(path)
+
+
+def _unlink_quietly(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
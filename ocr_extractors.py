@@ -1,13 +1,93 @@
 import re
 import logging
+import copy
+import hashlib
+import threading
+from functools import lru_cache
+from collections import OrderedDict
 from typing import Dict, List, Any, Tuple, Optional
 import os
 from datetime import datetime
 
-# ロギング設定
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 抽出ロジックのバージョン（抽出処理を変更したら上げる。POデータのキャッシュキーに含める）
+EXTRACTOR_VERSION = 1
+
+# extract_po_dataの結果キャッシュ（テキストのハッシュ → (フォーマット, 抽出結果)）
+PO_DATA_CACHE_SIZE = 256
+_po_data_cache: "OrderedDict[bytes, Tuple[str, Dict[str, Any]]]" = OrderedDict()
+_po_data_cache_lock = threading.Lock()
+
+# フォーマット判定のための特徴と重み
+PO_FORMAT_FEATURES = {
+    "format1": [
+        (r"\(Buyer(?:'|')s Info\)", 10),  # 最も重要な特徴
+        (r"ABC Company", 5),
+        (r"Purchase Order:?\s*\d+", 5),
+        (r"Ship to:", 3),
+        (r"Unit Price:?\s*\$", 3),
+        (r"EXT Price:", 3),
+        (r"Inco Terms:", 2),
+        (r"Del Date:", 2)
+    ],
+    "format2": [
+        (r"Purchase Order\s*$", 10),  # 最も重要な特徴
+        (r"Supplier:", 5),
+        (r"Purchase Order no:?\s*\d+", 5),
+        (r"Payment Terms:", 3),
+        (r"Incoterms:", 3),
+        (r"Discharge Port:", 3),
+        (r"Buyer:", 3),
+        (r"Commodity", 2),
+        (r"Grand Total", 2)
+    ],
+    "format3": [
+        (r"(?:\/\/\/|///)ORDER CONFIMATION(?:\/\/\/|///)", 10),  # 最も重要な特徴
+        (r"Contract Party\s*:", 5),
+        (r"Order No\.", 5),
+        (r"Grade [A-Z]", 3),
+        (r"Qt'y \(mt\)", 3), 
+        (r"PORT OF DISCHARGE", 3),
+        (r"Payment term", 2),
+        (r"TIME OF SHIPMENT", 2),
+        (r"PORT OF LOADING", 2)
+    ]
+}
+
+# 判定用の正規表現はモジュール読み込み時に1回だけコンパイルする
+_PO_FORMAT_FEATURE_PATTERNS = {
+    format_name: [(re.compile(pattern, re.IGNORECASE), weight) for pattern, weight in features]
+    for format_name, features in PO_FORMAT_FEATURES.items()
+}
+
+# 抽出処理で繰り返し使用する正規表現（モジュール読み込み時にコンパイル）
+_CURRENCY_RE = re.compile(r"(USD|EUR|JPY|CNY)")
+_FIELD_VALUE_TRIM_RE = re.compile(r'^[:\s]+|[:\s]+$')
+_WHITESPACE_RE = re.compile(r'\s+')
+_PO_NUMBER_TRIM_RE = re.compile(r'^[:;,.\s]+|[:;,.\s]+$')
+_NON_NUMERIC_RE = re.compile(r'[^\d.,]')
+_QUANTITY_IN_NAME_RE = re.compile(r'(\d+(?:\.\d+)?)\s*(?:pcs|pieces|units|qty|kg|mt)', re.IGNORECASE)
+_QUANTITY_IN_NAME_REMOVE_RE = re.compile(r'\s*\d+(?:\.\d+)?\s*(?:pcs|pieces|units|qty|kg|mt)', re.IGNORECASE)
+
+# フォーマット2の製品表
+_FORMAT2_PRODUCT_ROW_RE = re.compile(r"(?:[A-Za-z0-9]+)\s+(Product [A-Za-z])\s+([\d,]+)\s*kg\s+US\$?([\d.]+)\s+US\$?([\d,.]+)", re.IGNORECASE)
+_FORMAT2_PRODUCT_SECTION_RE = re.compile(r"(\d[a-z])\s+(Product [A-Za-z])\s+([\d,]+)\s*kg\s+US\$?([\d.]+)\s+US\$?([\d,.]+)", re.IGNORECASE)
+_FORMAT2_PRODUCT_NAME_RE = re.compile(r"Product ([A-Z])")
+_FORMAT2_QUANTITY_RE = re.compile(r"([\d,]+)\s*kg")
+_FORMAT2_PRICE_RE = re.compile(r"US\$\s*([\d.]+)")
+_FORMAT2_SUBTOTAL_RE = re.compile(r"US\$\s*([\d,.]+)(?:\.00)?(?:\s|$)")
+
+# 汎用フォーマットの製品表
+_GENERIC_PRODUCT_ROW_RE = re.compile(r"([A-Za-z0-9]+)\s+(Product [A-Za-z]|Grade [A-Za-z0-9]+)\s+([\d,]+)\s*(?:kg|mt)\s+(?:US\$)?([\d.]+)\s+(?:US\$)?([\d,.]+)")
+_GENERIC_PRODUCT_SECTION_RE = re.compile(r"(?:Product [A-Za-z]|Grade [A-Za-z0-9]+|Item:.*?).*?(\d+)(?:\s*|\n+)(?:kg|mt|KG|MT).*?(?:US\$|Unit Price:?\s*\$?)?\s*([\d,.]+).*?(?:US\$)?\s*([\d,.]+)", re.DOTALL)
+_GENERIC_PRODUCT_NAME_RE = re.compile(r"(?:Product ([A-Z])|Grade ([A-Za-z0-9]+)|Item:\s*(.*?)(?:\n|$))")
+
+@lru_cache(maxsize=None)
+def _compile_field_pattern(pattern: str) -> "re.Pattern":
+    """extract_field_by_regexで使用するパターンをコンパイルする（パターンごとに1回のみ）"""
+    return re.compile(pattern, re.IGNORECASE | re.MULTILINE)
+
 def extract_field_by_regex(text: str, patterns: List[str], default_value: str = "") -> str:
     """
     複数の正規表現パターンを試して、最初にマッチするフィールド値を抽出します
@@ -21,11 +101,11 @@ def extract_field_by_regex(text: str, patterns: List[str], default_value: str =
         抽出された値またはデフォルト値
     """
     for pattern in patterns:
-        match = re.search(pattern, text, re.IGNORECASE | re.MULTILINE)
+        match = _compile_field_pattern(pattern).search(text)
         if match and match.group(1).strip():
             value = match.group(1).strip()
             # 余計な記号を削除
-            value = re.sub(r'^[:\s]+|[:\s]+$', '', value)
+            value = _FIELD_VALUE_TRIM_RE.sub('', value)
             return value
     return default_value
 
@@ -41,48 +121,12 @@ def identify_po_format(text: str) -> str:
     """
     logger.info("POフォーマット判別開始")
     
-    # フォーマット判定のための特徴と重み
-    format_features = {
-        "format1": [
-            (r"\(Buyer(?:'|')s Info\)", 10),  # 最も重要な特徴
-            (r"ABC Company", 5),
-            (r"Purchase Order:?\s*\d+", 5),
-            (r"Ship to:", 3),
-            (r"Unit Price:?\s*\$", 3),
-            (r"EXT Price:", 3),
-            (r"Inco Terms:", 2),
-            (r"Del Date:", 2)
-        ],
-        "format2": [
-            (r"Purchase Order\s*$", 10),  # 最も重要な特徴
-            (r"Supplier:", 5),
-            (r"Purchase Order no:?\s*\d+", 5),
-            (r"Payment Terms:", 3),
-            (r"Incoterms:", 3),
-            (r"Discharge Port:", 3),
-            (r"Buyer:", 3),
-            (r"Commodity", 2),
-            (r"Grand Total", 2)
-        ],
-        "format3": [
-            (r"(?:\/\/\/|///)ORDER CONFIMATION(?:\/\/\/|///)", 10),  # 最も重要な特徴
-            (r"Contract Party\s*:", 5),
-            (r"Order No\.", 5),
-            (r"Grade [A-Z]", 3),
-            (r"Qt'y \(mt\)", 3), 
-            (r"PORT OF DISCHARGE", 3),
-            (r"Payment term", 2),
-            (r"TIME OF SHIPMENT", 2),
-            (r"PORT OF LOADING", 2)
-        ]
-    }
-    
     # 各フォーマットの一致スコアを計算
     format_scores = {}
-    for format_name, features in format_features.items():
+    for format_name, features in _PO_FORMAT_FEATURE_PATTERNS.items():
         score = 0
         for pattern, weight in features:
-            if re.search(pattern, text, re.IGNORECASE):
+            if pattern.search(text):
                 score += weight
         format_scores[format_name] = score
     
@@ -133,7 +177,7 @@ def extract_format1_data(text: str) -> Dict[str, Any]:
     ])
     
     # 通貨の抽出
-    currency_match = re.search(r"(USD|EUR|JPY|CNY)", text)
+    currency_match = _CURRENCY_RE.search(text)
     if currency_match:
         result["currency"] = currency_match.group(1)
     
@@ -232,7 +276,7 @@ def extract_format2_data(text: str) -> Dict[str, Any]:
     ])
     
     # 通貨の抽出
-    currency_match = re.search(r"(USD|EUR|JPY|CNY)", text)
+    currency_match = _CURRENCY_RE.search(text)
     if currency_match:
         result["currency"] = currency_match.group(1)
     
@@ -251,7 +295,7 @@ def extract_format2_data(text: str) -> Dict[str, Any]:
     # 製品情報の抽出 - 表形式データからの抽出（複数製品対応）
     try:
         # 方法1: 表形式からの抽出
-        product_rows = re.findall(r"(?:[A-Za-z0-9]+)\s+(Product [A-Za-z])\s+([\d,]+)\s*kg\s+US\$?([\d.]+)\s+US\$?([\d,.]+)", text, re.IGNORECASE)
+        product_rows = _FORMAT2_PRODUCT_ROW_RE.findall(text)
         
         if product_rows:
             for row_match in product_rows:
@@ -264,7 +308,7 @@ def extract_format2_data(text: str) -> Dict[str, Any]:
                 })
         else:
             # 方法2: 別の表形式パターン
-            product_sections = re.findall(r"(\d[a-z])\s+(Product [A-Za-z])\s+([\d,]+)\s*kg\s+US\$?([\d.]+)\s+US\$?([\d,.]+)", text, re.IGNORECASE)
+            product_sections = _FORMAT2_PRODUCT_SECTION_RE.findall(text)
             
             if product_sections:
                 for _, name, quantity, unit_price, subtotal in product_sections:
@@ -277,10 +321,10 @@ def extract_format2_data(text: str) -> Dict[str, Any]:
             else:
                 # 方法3: 別パターンでの検索
                 # 製品名のリストを抽出
-                product_names = re.findall(r"Product ([A-Z])", text)
-                quantities = re.findall(r"([\d,]+)\s*kg", text)
-                prices = re.findall(r"US\$\s*([\d.]+)", text)
-                subtotals = re.findall(r"US\$\s*([\d,.]+)(?:\.00)?(?:\s|$)", text)
+                product_names = _FORMAT2_PRODUCT_NAME_RE.findall(text)
+                quantities = _FORMAT2_QUANTITY_RE.findall(text)
+                prices = _FORMAT2_PRICE_RE.findall(text)
+                subtotals = _FORMAT2_SUBTOTAL_RE.findall(text)
                 
                 # マッチング調整
                 if len(subtotals) > len(product_names):
@@ -464,7 +508,7 @@ def extract_generic_data(text: str) -> Dict[str, Any]:
     ])
     
     # 通貨を抽出
-    currency_match = re.search(r"(USD|EUR|JPY|CNY)", text)
+    currency_match = _CURRENCY_RE.search(text)
     if currency_match:
         result["currency"] = currency_match.group(1)
     else:
@@ -487,7 +531,7 @@ def extract_generic_data(text: str) -> Dict[str, Any]:
     product_extracted = False
     
     # 方法1: 表形式データからの抽出
-    product_rows = re.findall(r"([A-Za-z0-9]+)\s+(Product [A-Za-z]|Grade [A-Za-z0-9]+)\s+([\d,]+)\s*(?:kg|mt)\s+(?:US\$)?([\d.]+)\s+(?:US\$)?([\d,.]+)", text)
+    product_rows = _GENERIC_PRODUCT_ROW_RE.findall(text)
     if product_rows:
         for _, name, quantity, unit_price, subtotal in product_rows:
             result["products"].append({
@@ -500,12 +544,12 @@ def extract_generic_data(text: str) -> Dict[str, Any]:
     
     # 方法2: セクション形式からの抽出
     if not product_extracted:
-        product_sections = re.findall(r"(?:Product [A-Za-z]|Grade [A-Za-z0-9]+|Item:.*?).*?(\d+)(?:\s*|\n+)(?:kg|mt|KG|MT).*?(?:US\$|Unit Price:?\s*\$?)?\s*([\d,.]+).*?(?:US\$)?\s*([\d,.]+)", text, re.DOTALL)
+        product_sections = _GENERIC_PRODUCT_SECTION_RE.findall(text)
         if product_sections:
             for i, (quantity, unit_price, subtotal) in enumerate(product_sections):
                 # 製品名の抽出を試みる
                 product_name = ""
-                name_match = re.search(r"(?:Product ([A-Z])|Grade ([A-Za-z0-9]+)|Item:\s*(.*?)(?:\n|$))", text)
+                name_match = _GENERIC_PRODUCT_NAME_RE.search(text)
                 if name_match:
                     if name_match.group(1):
                         product_name = f"Product {name_match.group(1)}"
@@ -580,11 +624,11 @@ def validate_and_clean_result(data: Dict[str, Any]) -> Dict[str, Any]:
     for field in string_fields:
         if field in cleaned and cleaned[field]:
             # 余分な空白、タブ、改行を削除
-            cleaned[field] = re.sub(r'\s+', ' ', cleaned[field]).strip()
+            cleaned[field] = _WHITESPACE_RE.sub(' ', cleaned[field]).strip()
             
             # 不要な記号を削除（コロン、カンマなど）
             if field == "po_number":
-                cleaned[field] = re.sub(r'^[:;,.\s]+|[:;,.\s]+$', '', cleaned[field])
+                cleaned[field] = _PO_NUMBER_TRIM_RE.sub('', cleaned[field])
     
     # 製品情報が空の場合にデフォルト値を設定
     if not cleaned["products"]:
@@ -611,13 +655,13 @@ def validate_and_clean_result(data: Dict[str, Any]) -> Dict[str, Any]:
                 if qty <= 0 or qty > 100000:
                     # 商品名から数量を探す試み
                     if "product_name" in product and product["product_name"]:
-                        qty_match = re.search(r'(\d+(?:\.\d+)?)\s*(?:pcs|pieces|units|qty|kg|mt)', product["product_name"], re.IGNORECASE)
+                        qty_match = _QUANTITY_IN_NAME_RE.search(product["product_name"])
                         if qty_match:
                             try:
                                 qty = float(qty_match.group(1))
                                 cleaned["products"][i]["quantity"] = str(qty)
                                 # 抽出した部分を商品名から削除
-                                cleaned["products"][i]["product_name"] = re.sub(r'\s*\d+(?:\.\d+)?\s*(?:pcs|pieces|units|qty|kg|mt)', '', product["product_name"], flags=re.IGNORECASE)
+                                cleaned["products"][i]["product_name"] = _QUANTITY_IN_NAME_REMOVE_RE.sub('', product["product_name"])
                             except (ValueError, TypeError):
                                 pass
             
@@ -666,7 +710,7 @@ def _clean_numeric_field(value: str) -> str:
         return ""
     
     # 通貨記号や単位などを削除（カンマとピリオドは保持）
-    cleaned = re.sub(r'[^\d.,]', '', value)
+    cleaned = _NON_NUMERIC_RE.sub('', value)
     
     # カンマとピリオドの位置を確認
     comma_pos = cleaned.rfind(',')
@@ -733,6 +777,17 @@ def extract_po_data(text: str) -> Dict[str, Any]:
     """
     logger.info("POデータ抽出開始")
     
+    # 同じテキストを処理済みであればキャッシュから返す（呼び出し側で変更されるためコピーを返す）
+    cache_key = hashlib.blake2b(text.encode(), digest_size=16).digest()
+    with _po_data_cache_lock:
+        cached = _po_data_cache.get(cache_key)
+        if cached is not None:
+            _po_data_cache.move_to_end(cache_key)
+    if cached is not None:
+        po_format, cached_result = cached
+        logger.info(f"キャッシュ済みのPOデータを使用します: フォーマット={po_format}")
+        return copy.deepcopy(cached_result)
+    
     # フォーマットを識別
     po_format = identify_po_format(text)
     logger.info(f"識別されたPOフォーマット: {po_format}")
@@ -762,5 +817,11 @@ def extract_po_data(text: str) -> Dict[str, Any]:
             if "product_name" not in product and "name" in product:
                 cleaned_result["products"][i]["product_name"] = product["name"]
                 
+    # 結果をキャッシュに保存
+    with _po_data_cache_lock:
+        _po_data_cache[cache_key] = (po_format, copy.deepcopy(cleaned_result))
+        if len(_po_data_cache) > PO_DATA_CACHE_SIZE:
+            _po_data_cache.popitem(last=False)
+    
     logger.info("POデータ抽出完了と標準化")
     return cleaned_result
@@ -5,44 +5,201 @@ import os
 import uuid
 import logging
 import shutil
-import json
 import time
-from typing import Dict, List, Any, Tuple, Optional
+from typing import Dict, List, Any, Tuple, Optional, Union
+import orjson
 import pytesseract
-from pdf2image import convert_from_path
-from PIL import Image, ImageEnhance
+from pdf2image import convert_from_path, pdfinfo_from_path
+from PIL import Image, ImageFile
+import numpy as np
+import cv2
 import io
 import tempfile
 import re
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
+from sqlalchemy import update
 from sqlalchemy.orm import Session
 
 # OCR処理で抽出する内容の設定（必要に応じて拡張）
-from config import UPLOAD_FOLDER, OCR_TEMP_FOLDER
+from config import UPLOAD_FOLDER, OCR_TEMP_FOLDER, OCR_DPI, OCR_ENGINE, OCR_CONCURRENCY
 import models
+import ocr_cache
 from ocr_extractors import (
     identify_po_format, 
     extract_po_data
 )
 
-# ロギングの設定
-logging.basicConfig(level=logging.INFO)
+# GPU（CuPy）が使用可能な場合は複数ページの前処理をまとめてGPUで実行する
+try:
+    import cupy as cp
+    from cupyx.scipy import ndimage as cp_ndimage
+except Exception:
+    cp = None
+
 logger = logging.getLogger(__name__)
 
+# PDF→画像変換（pdftoppm）で使用するスレッド数
+# （同時に処理するドキュメント数との積がCPU数程度に収まるようにする）
+PDF_THREAD_COUNT = max(1, (os.cpu_count() or 1) // OCR_CONCURRENCY)
+
+# ページ単位の処理（前処理・OCR）を並列実行するスレッド数
+# （OpenCVとtesseractのサブプロセスはGILを解放するため、スレッドで並列化できる）
+OCR_PAGE_WORKERS = PDF_THREAD_COUNT
+
+# ページやドキュメントを並列にOCRする場合、tesseract自身のOpenMPスレッドは1つに制限する
+# （1回の呼び出しで全ページを処理する場合は、ドキュメントに割り当てたスレッド数まで使用する）
+if OCR_CONCURRENCY > 1 or OCR_PAGE_WORKERS > 1:
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+# PDFのラスタライズ解像度（1ページ目の低解像度OCRの信頼度が閾値を超えれば低解像度を使用）
+PDF_LOW_DPI = 150
+PDF_HIGH_DPI = OCR_DPI
+PDF_LOW_DPI_MIN_CONFIDENCE = 80
+
+# OCRの言語（POは英語のため通常はengのみ。engで読み取れない場合のみ日本語を追加して1回だけ再試行する。
+# tesseractは言語の指定順で結果が変わらないため、'jpn+eng' は試行しない）
+OCR_DEFAULT_LANG = 'eng'
+OCR_JAPANESE_LANG = 'eng+jpn'
+_tesseract_has_jpn: Optional[bool] = None
+
+# 一部が破損したスキャン画像も読み込めるところまで読み込む
+ImageFile.LOAD_TRUNCATED_IMAGES = True
+
+# 画像ファイルのデコード時の目標サイズ（A4・300dpi。JPEGはデコード時にこのサイズ以上まで縮小される）
+IMAGE_DRAFT_SIZE = (2480, 3508)
+
+# OCR対象の画像ファイルの拡張子
+OCR_IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif']
+
+# OCR_ENGINE=paddle の場合に使用するPaddleOCR（オプション）のインスタンス
+# （パッケージのインポートとモデルの読み込みが重いため、ワーカーでの最初の使用時に1回だけ行う）
+_paddle_ocr = None
+_paddle_ocr_unavailable = False
+_paddle_ocr_lock = threading.Lock()
+
+# GPUの有無（CUDAの初期化はgunicornのマスタープロセスで行わないよう、ワーカーでの最初の使用時に判定する）
+_has_gpu: Optional[bool] = None
+_has_gpu_lock = threading.Lock()
+
+# 処理結果に記録する日時のフォーマット
+TIMESTAMP_FMT = "%Y-%m-%d %H:%M:%S"
+
+# JSON解析を省略する空の処理済みデータ
+EMPTY_PROCESSED_DATA = ("", "{}")
+
+# 一時ファイルとして書き出すPNGの圧縮レベル（すぐに削除されるため圧縮よりも速度を優先）
+TEMP_PNG_COMPRESS_LEVEL = 1
+# ImageMagickのPNG出力品質（十の位がzlibの圧縮レベル、一の位がフィルタ）
+IMAGEMAGICK_PNG_QUALITY = "10"
+
+# ImageMagickによるPDF変換のタイムアウト（秒）
+IMAGEMAGICK_TIMEOUT = 120
+# pdftoppmとtesseractのパイプラインによるOCRのタイムアウト（秒）
+OCR_PIPELINE_TIMEOUT = 120
+# ImageMagick 7は magick、6以前は convert コマンド
+IMAGEMAGICK_COMMAND = ["magick"] if shutil.which("magick") else ["convert"]
+IMAGEMAGICK_PAGE_FILE_RE = re.compile(r"page_(\d+)\.png")
+
+# コントラストと明るさの調整係数（ルックアップテーブルで1回に変換する）
+CONTRAST_FACTOR = 2.0
+BRIGHTNESS_FACTOR = 1.2
+_LUT_INPUT = np.arange(256, dtype=np.float32)
+
+# シャープネス(1.5)強調用の3x3カーネル（元画像とPILのSMOOTHフィルタの合成）
+_SMOOTH_KERNEL = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype=np.float32) / 13
+_IDENTITY_KERNEL = np.zeros((3, 3), dtype=np.float32)
+_IDENTITY_KERNEL[1, 1] = 1
+SHARPEN_KERNEL = 1.5 * _IDENTITY_KERNEL - 0.5 * _SMOOTH_KERNEL
+
+# この標準偏差を超える画像は十分なコントラストがあるとみなし、強調処理を省略する
+CLEAN_PAGE_STD_THRESHOLD = 60
+
+# GPUで一度に前処理するページ数の上限（GPUメモリの使用量を抑えるため）
+GPU_BATCH_PAGES = 16
+
+# PDF処理に失敗した場合に返すモックテキスト（UIの動作を停止させないため）
+_MOCK_PO_TEXT = "Purchase Order No. 12345\nBuyer's Info: Sample Company\nProduct: Sample Product\nQuantity: 1000kg\nUnit Price: $2.50\nTotal Amount: $2500.00\nPayment Terms: NET 30\nShipping Terms: CIF\nDestination: Tokyo"
+PDF_CONVERSION_FAILED_MOCK_TEXT = f"MOCK {_MOCK_PO_TEXT}"
+PDF_ERROR_MOCK_TEXT = f"ERROR MOCK {_MOCK_PO_TEXT}"
+
+# 一般的なpopplerインストールパス
+POPPLER_SEARCH_PATHS = [
+    '/usr/bin',
+    '/usr/local/bin',
+    '/opt/homebrew/bin',
+    '/usr/local/Cellar/poppler/21.08.0/bin',
+    'C:\\Program Files\\poppler\\bin',
+    '/opt/poppler/bin',
+    '/app/.apt/usr/bin'  # Heroku環境などでの場所
+]
+
 class OCRError(Exception):
     """OCR処理中のエラーを表す例外クラス"""
     pass
 
+def find_poppler_path() -> Optional[str]:
+    """
+    popplerのコマンドが存在するディレクトリを探す（モジュール読み込み時に1回だけ実行）
+    
+    Returns:
+        popplerのディレクトリ（PATH上で利用可能な場合、または見つからない場合はNone）
+    """
+    try:
+        subprocess.run(["pdfinfo", "-v"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=10)
+        logger.info("popplerはPATH上で利用可能です")
+        return None
+    except (OSError, subprocess.SubprocessError):
+        pass
+    
+    for path in POPPLER_SEARCH_PATHS:
+        if any(os.path.exists(os.path.join(path, name)) for name in ("pdftoppm", "pdftoppm.exe")):
+            logger.info(f"poppler_pathを検出: {path}")
+            return path
+    
+    logger.warning("popplerが見つかりません。PDF変換はImageMagickにフォールバックします")
+    return None
+
+# PDF変換で使用するpoppler_path（Noneの場合はPATHを使用）
+POPPLER_PATH = find_poppler_path()
+
 def ensure_directories_exist():
     """必要なディレクトリが存在することを確認する"""
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
     os.makedirs(OCR_TEMP_FOLDER, exist_ok=True)
     logger.info(f"ディレクトリの確認: UPLOAD_FOLDER={UPLOAD_FOLDER}, OCR_TEMP_FOLDER={OCR_TEMP_FOLDER}")
     
-    # ディレクトリの権限も確認
-    for dir_path in [UPLOAD_FOLDER, OCR_TEMP_FOLDER]:
-        readable = os.access(dir_path, os.R_OK)
-        writable = os.access(dir_path, os.W_OK)
-        logger.info(f"ディレクトリ {dir_path} の権限: 読み取り={readable}, 書き込み={writable}")
+    # ディレクトリの権限はデバッグ時のみ確認
+    if logger.isEnabledFor(logging.DEBUG):
+        for dir_path in [UPLOAD_FOLDER, OCR_TEMP_FOLDER]:
+            readable = os.access(dir_path, os.R_OK)
+            writable = os.access(dir_path, os.W_OK)
+            logger.debug(f"ディレクトリ {dir_path} の権限: 読み取り={readable}, 書き込み={writable}")
+
+# ディレクトリの確認はモジュール読み込み時に1回だけ行う（アップロードごとには行わない）
+try:
+    ensure_directories_exist()
+except OSError as e:
+    logger.warning(f"ディレクトリの作成に失敗: {str(e)}")
+
+def write_uploaded_file(file, file_path: str):
+    """
+    アップロードされたファイルを1MiBずつ書き込み、同時にOCRキャッシュ用のハッシュを計算する
+    
+    ファイル全体をメモリに読み込まないため、大きなPDFでもメモリ使用量は一定です。
+    
+    Args:
+        file: FastAPIのUploadFileオブジェクト
+        file_path: 保存先のパス
+    """
+    hasher = ocr_cache.new_hasher()
+    with open(file_path, "wb") as buffer:
+        for chunk in iter(lambda: file.file.read(ocr_cache.HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+            buffer.write(chunk)
+    ocr_cache.remember_file_hash(file_path, hasher.hexdigest())
 
 def save_uploaded_file(file, destination_folder: str = UPLOAD_FOLDER) -> str:
     """
@@ -55,9 +212,6 @@ def save_uploaded_file(file, destination_folder: str = UPLOAD_FOLDER) -> str:
     Returns:
         保存されたファイルのパス
     """
-    # ディレクトリの存在確認
-    ensure_directories_exist()
-    
     # 一意のファイル名を生成
     unique_id = str(uuid.uuid4())
     filename = f"{unique_id}_{file.filename}"
@@ -65,9 +219,7 @@ def save_uploaded_file(file, destination_folder: str = UPLOAD_FOLDER) -> str:
     
     try:
         # ファイルを保存
-        content = file.file.read()
-        with open(file_path, "wb") as buffer:
-            buffer.write(content)
+        write_uploaded_file(file, file_path)
         
         # ファイルの先頭に戻す（他の処理で再度読み込めるように）
         file.file.seek(0)
@@ -98,34 +250,34 @@ def process_ocr_with_enhanced_extraction(file_path: str, ocr_id: int, db: Sessio
             logger.info(f"OCRテキスト抽出完了: {len(raw_text)} 文字")
         except Exception as e:
             logger.error(f"OCRテキスト抽出エラー: {str(e)}")
-            update_ocr_result(db, ocr_id, "", "{}", "failed", f"OCRテキスト抽出エラー: {str(e)}")
+            update_ocr_result(db, ocr_id, "", {}, "failed", f"OCRテキスト抽出エラー: {str(e)}")
             return
         
         processing_time = time.time() - start_time
         
         # PO情報の抽出
         try:
-            extracted_data = extract_po_data(raw_text)
+            extracted_data = extract_po_data_cached(raw_text)
             logger.info("POデータ抽出完了")
         except Exception as e:
             logger.error(f"POデータ抽出エラー: {str(e)}")
             # OCRテキストは保存するが、抽出は失敗とマーク
-            update_ocr_result(db, ocr_id, raw_text, "{}", "failed", f"POデータ抽出エラー: {str(e)}")
+            update_ocr_result(db, ocr_id, raw_text, {}, "failed", f"POデータ抽出エラー: {str(e)}")
             return
         
         # 抽出結果と統計情報を含む完全な結果を保存
         complete_result = {
             "data": extracted_data,
             "processing_time": processing_time,
-            "ocr_timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+            "ocr_timestamp": time.strftime(TIMESTAMP_FMT)
         }
         
         # 結果をJSONに変換して保存
         try:
-            processed_data = json.dumps(complete_result, ensure_ascii=False)
+            processed_data = orjson.dumps(complete_result).decode()
         except Exception as e:
             logger.error(f"JSON変換エラー: {str(e)}")
-            processed_data = json.dumps({"error": f"JSON変換エラー: {str(e)}"})
+            processed_data = orjson.dumps({"error": f"JSON変換エラー: {str(e)}"}).decode()
         
         # データベースに結果を保存
         update_ocr_result(db, ocr_id, raw_text, processed_data, "completed")
@@ -134,7 +286,7 @@ def process_ocr_with_enhanced_extraction(file_path: str, ocr_id: int, db: Sessio
         
     except Exception as e:
         logger.error(f"拡張OCR処理エラー: {str(e)}")
-        update_ocr_result(db, ocr_id, "", "{}", "failed", str(e))
+        update_ocr_result(db, ocr_id, "", {}, "failed", str(e))
 
 def process_document(file_path: str) -> str:
     """
@@ -158,23 +310,184 @@ def process_document(file_path: str) -> str:
     file_ext = os.path.splitext(file_path)[1].lower()
     
     try:
+        # 同じ内容のファイルを処理済みであればキャッシュから返す
+        # （キャッシュキーにはテキストを実際に抽出したエンジンを使用する）
+        file_hash = ocr_cache.compute_file_hash(file_path)
+        
+        # PaddleOCRが指定されていれば優先して使用し、抽出できなければtesseractで処理
+        if OCR_ENGINE == 'paddle' and (file_ext == '.pdf' or file_ext in OCR_IMAGE_EXTENSIONS):
+            cached_text = ocr_cache.get(file_hash, 'paddle')
+            if cached_text is not None:
+                logger.info(f"キャッシュ済みのOCRテキストを使用します: {file_hash}")
+                return cached_text
+            text = process_document_paddle(file_path, file_ext)
+            if text:
+                logger.info("PaddleOCRでテキストを抽出しました")
+                if is_cacheable_ocr_text(text):
+                    ocr_cache.put(file_hash, text, 'paddle')
+                return text
+        
+        cached_text = ocr_cache.get(file_hash, 'tesseract')
+        if cached_text is not None:
+            logger.info(f"キャッシュ済みのOCRテキストを使用します: {file_hash}")
+            return cached_text
+        
         # PDFファイルの場合
         if file_ext == '.pdf':
             logger.info("PDFファイルを処理します")
-            return process_pdf(file_path)
+            text = process_pdf(file_path)
         # 画像ファイルの場合
-        elif file_ext in ['.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif']:
+        elif file_ext in OCR_IMAGE_EXTENSIONS:
             logger.info("画像ファイルを処理します")
-            return process_image(file_path)
+            text = process_image(file_path)
         else:
             error_msg = f"サポートされていないファイル形式です: {file_ext}"
             logger.error(error_msg)
             raise OCRError(error_msg)
+        
+        if is_cacheable_ocr_text(text):
+            ocr_cache.put(file_hash, text, 'tesseract')
+        return text
     except Exception as e:
         logger.error(f"ドキュメント処理中にエラーが発生: {str(e)}")
         raise OCRError(f"ドキュメント処理中にエラーが発生: {str(e)}")
   
 
+def gpu_available() -> bool:
+    """
+    GPU（CuPy）が使用可能かを返す（初回のみ判定）
+    """
+    global _has_gpu
+    if cp is None:
+        return False
+    with _has_gpu_lock:
+        if _has_gpu is None:
+            try:
+                _has_gpu = cp.cuda.runtime.getDeviceCount() > 0
+            except Exception:
+                _has_gpu = False
+        return _has_gpu
+
+def get_paddle_ocr():
+    """
+    PaddleOCRのインスタンスを返す（初回のみ作成。使用できない場合はNone）
+    """
+    global _paddle_ocr, _paddle_ocr_unavailable
+    with _paddle_ocr_lock:
+        if _paddle_ocr is None and not _paddle_ocr_unavailable:
+            try:
+                from paddleocr import PaddleOCR
+            except ImportError:
+                _paddle_ocr_unavailable = True
+                return None
+            logger.info("PaddleOCRのモデルを読み込んでいます")
+            _paddle_ocr = PaddleOCR(use_angle_cls=True, lang='en', use_gpu=gpu_available(), det_db_score_mode='fast')
+        return _paddle_ocr
+
+def process_document_paddle(file_path: str, file_ext: str) -> str:
+    """
+    PaddleOCRでPDFまたは画像ファイルからテキストを抽出
+    
+    Args:
+        file_path: 処理するファイルのパス
+        file_ext: ファイル拡張子（小文字）
+        
+    Returns:
+        抽出されたテキスト（PaddleOCRが使用できないか失敗した場合は空文字列）
+    """
+    try:
+        ocr = get_paddle_ocr()
+        if ocr is None:
+            logger.warning("OCR_ENGINE=paddle ですがpaddleocrパッケージがありません。tesseractで処理します")
+            return ""
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            if file_ext == '.pdf':
+                page_paths = convert_from_path(
+                    file_path,
+                    output_folder=temp_dir,
+                    fmt="ppm",
+                    dpi=OCR_DPI,
+                    thread_count=PDF_THREAD_COUNT,
+                    paths_only=True,
+                    poppler_path=POPPLER_PATH
+                )
+            else:
+                page_paths = [file_path]
+            
+            page_texts = []
+            for page_path in page_paths:
+                image = cv2.imread(page_path)
+                if image is None:
+                    raise OCRError(f"画像を読み込めません: {page_path}")
+                
+                # 検出したテキスト領域はPaddleOCR内部でまとめて認識される
+                # （インスタンスはスレッドセーフではないため排他制御する）
+                with _paddle_ocr_lock:
+                    result = ocr.ocr(image, cls=True)
+                lines = [line[1][0] for line in (result[0] or [])] if result else []
+                page_texts.append("\n".join(lines))
+        
+        if not any(page_text.strip() for page_text in page_texts):
+            return ""
+        if file_ext != '.pdf':
+            return page_texts[0].strip()
+        return "".join(
+            f"\n--- Page {i+1} ---\n{page_text}" for i, page_text in enumerate(page_texts)
+        ).strip()
+    except Exception as e:
+        logger.warning(f"PaddleOCRでの処理が失敗したためtesseractで処理します: {str(e)}")
+        return ""
+
+def is_cacheable_ocr_text(text: str) -> bool:
+    """空のテキストやモックテキスト（変換失敗時）はキャッシュしない"""
+    return bool(text) and text not in (PDF_CONVERSION_FAILED_MOCK_TEXT, PDF_ERROR_MOCK_TEXT)
+
+def extract_po_data_cached(ocr_text: str) -> Dict[str, Any]:
+    """
+    POデータを抽出する（同じOCRテキストからの抽出結果はキャッシュから返す）
+    
+    Args:
+        ocr_text: OCRで抽出されたテキスト
+        
+    Returns:
+        抽出されたPOデータ
+    """
+    if not is_cacheable_ocr_text(ocr_text):
+        return extract_po_data(ocr_text)
+    
+    # OCRテキストのハッシュをキーにし、OCR結果が変わった場合に古い抽出結果を返さないようにする
+    text_hash = ocr_cache.hash_text(ocr_text)
+    po_data = ocr_cache.get_po_data(text_hash)
+    if po_data is not None:
+        logger.info(f"キャッシュ済みのPOデータを使用します: {text_hash}")
+        return po_data
+    
+    po_data = extract_po_data(ocr_text)
+    ocr_cache.put_po_data(text_hash, po_data)
+    return po_data
+
+def build_enhancement_lut(arr: np.ndarray) -> Optional[np.ndarray]:
+    """
+    コントラストと明るさの調整を行うルックアップテーブルを画像ごとに作成する
+    
+    PILのImageEnhance.Contrastと同じく、画像の平均輝度を中心にコントラストを強調する。
+    
+    Args:
+        arr: グレースケール画像の配列
+        
+    Returns:
+        256要素のルックアップテーブル（十分なコントラストがあり強調不要な場合はNone）
+    """
+    # 間引いた画素で判定と平均輝度の計算を行う
+    sample = arr[::8, ::8]
+    if sample.std() > CLEAN_PAGE_STD_THRESHOLD:
+        return None
+    
+    pivot = int(sample.mean() + 0.5)
+    contrasted = np.clip(pivot + CONTRAST_FACTOR * (_LUT_INPUT - pivot), 0, 255).astype(np.uint8)
+    return np.clip(contrasted * BRIGHTNESS_FACTOR, 0, 255).astype(np.uint8)
+
 def preprocess_image(image):
     """
     画像の前処理を行う（OCR精度向上のため）
@@ -190,23 +503,62 @@ def preprocess_image(image):
         if image.mode != 'L':
             image = image.convert('L')
         
-        # コントラスト強調
-        enhancer = ImageEnhance.Contrast(image)
-        image = enhancer.enhance(2.0)
+        arr = np.asarray(image)
         
-        # 明るさ調整
-        enhancer = ImageEnhance.Brightness(image)
-        image = enhancer.enhance(1.2)
+        # コントラストが既に十分な画像は強調せずにそのまま返す（間引いた画素で判定）
+        lut = build_enhancement_lut(arr)
+        if lut is None:
+            return image
+        
+        # コントラスト強調と明るさ調整（LUTで一括変換）
+        arr = cv2.LUT(arr, lut)
         
         # シャープネス強調
-        enhancer = ImageEnhance.Sharpness(image)
-        image = enhancer.enhance(1.5)
+        arr = cv2.filter2D(arr, -1, SHARPEN_KERNEL)
         
-        return image
+        return Image.fromarray(arr)
     except Exception as e:
         logger.warning(f"画像前処理中にエラー: {e}")
         return image  # 元の画像を返す
 
+def preprocess_batch_gpu(images: List[Image.Image]) -> List[Image.Image]:
+    """
+    複数ページの画像の前処理をGPUでまとめて行う（preprocess_imageと同じ処理）
+    
+    Args:
+        images: PIL Image オブジェクトのリスト
+        
+    Returns:
+        前処理済みのPIL Image オブジェクトのリスト（強調不要な画像はそのまま返す）
+    """
+    results = [image if image.mode == 'L' else image.convert('L') for image in images]
+    
+    # 強調が必要なページのみを同じサイズごとにまとめる（LUTはページごとに作成）
+    groups: Dict[Tuple[int, int], List[int]] = {}
+    luts: Dict[int, np.ndarray] = {}
+    for i, image in enumerate(results):
+        lut = build_enhancement_lut(np.asarray(image))
+        if lut is None:
+            continue
+        luts[i] = lut
+        groups.setdefault(image.size, []).append(i)
+    
+    if not groups:
+        return results
+    
+    kernel = cp.asarray(SHARPEN_KERNEL[np.newaxis])
+    for indices in groups.values():
+        batch = cp.asarray(np.stack([np.asarray(results[i]) for i in indices]))
+        batch_luts = cp.asarray(np.stack([luts[i] for i in indices]))
+        # コントラスト強調と明るさ調整（ページごとのLUT）、シャープネス強調（cv2.filter2Dと同じ境界処理）
+        batch = batch_luts[cp.arange(len(indices))[:, None, None], batch].astype(cp.float32)
+        batch = cp_ndimage.correlate(batch, kernel, mode='mirror')
+        batch = cp.clip(cp.rint(batch), 0, 255).astype(cp.uint8)
+        for i, arr in zip(indices, cp.asnumpy(batch)):
+            results[i] = Image.fromarray(arr)
+    
+    return results
+
 def process_pdf(file_path: str) -> str:
     """
     PDFファイルを画像に変換し、テキストを抽出
@@ -225,144 +577,452 @@ def process_pdf(file_path: str) -> str:
         with tempfile.TemporaryDirectory() as temp_dir:
             logger.info(f"一時ディレクトリを作成: {temp_dir}")
             
+            # 1ページのPDFはpdftoppmの出力をtesseractに直接渡してOCR処理（画像ファイルを作成しない）
+            # 解像度判定のための試行OCRは行わない（1ページを2回OCRすることになるため）
+            first_page_text = None
+            if get_pdf_page_count(file_path) == 1:
+                dpi = PDF_HIGH_DPI
+                page_text = ocr_pdf_pipeline(file_path, dpi)
+                if page_text and page_text.strip():
+                    logger.info("PDFからのテキスト抽出が完了しました")
+                    return f"\n--- Page 1 ---\n{page_text}".strip()
+                logger.warning("パイプラインでのOCRに失敗したため、画像に変換して処理します")
+            else:
+                # 1ページ目の結果から変換解像度を決定（低解像度を採用する場合は1ページ目のテキストを再利用）
+                dpi, first_page_text = select_pdf_dpi(file_path)
+            
+            # 1ページ目のテキストを再利用する場合は2ページ目以降のみ変換する
+            skip_pages = 1 if first_page_text is not None else 0
+            
             # 複数の方法でPDF変換を試みる
-            images = None
+            # ページ画像はファイルパスのみ受け取り、OCR時に1枚ずつ読み込む
+            page_paths = None
             conversion_methods = [
                 # 方法1: 標準的な方法
-                lambda: convert_from_path(pdf_path, output_folder=temp_dir, fmt="png", dpi=300),
-                
-                # 方法2: poppler_pathを明示的に指定
-                lambda: try_with_poppler_paths(pdf_path, temp_dir),
+                lambda: convert_from_path(
+                    file_path,
+                    output_folder=temp_dir,
+                    fmt="ppm",  # グレースケールでは非圧縮のPGMを出力（エンコード処理なし）
+                    dpi=dpi,
+                    grayscale=True,
+                    first_page=1 + skip_pages,
+                    thread_count=PDF_THREAD_COUNT,
+                    paths_only=True,
+                    poppler_path=POPPLER_PATH
+                ),
                 
-                # 方法3: ImageMagickを使用
-                lambda: convert_with_imagemagick(pdf_path, temp_dir)
+                # 方法2: ImageMagickを使用（全ページを変換するため再利用するページを除く）
+                lambda: convert_with_imagemagick(file_path, temp_dir, dpi)[skip_pages:]
             ]
             
             # 各方法を順に試す
             for method_idx, conversion_method in enumerate(conversion_methods):
                 try:
                     logger.info(f"PDF変換方法 {method_idx+1} を試行中")
-                    images = conversion_method()
-                    if images and len(images) > 0:
-                        logger.info(f"方法 {method_idx+1} でPDFを{len(images)}枚の画像に変換しました")
+                    page_paths = conversion_method()
+                    if page_paths and len(page_paths) > 0:
+                        logger.info(f"方法 {method_idx+1} でPDFを{len(page_paths)}枚の画像に変換しました")
                         break
                 except Exception as e:
                     logger.warning(f"PDF変換方法 {method_idx+1} が失敗: {str(e)}")
             
             # 変換できなかった場合はモックデータを生成
-            if not images or len(images) == 0:
+            if not page_paths or len(page_paths) == 0:
                 logger.warning("すべてのPDF変換方法が失敗しました。モックデータを返します。")
-                return "MOCK Purchase Order No. 12345\nBuyer's Info: Sample Company\nProduct: Sample Product\nQuantity: 1000kg\nUnit Price: $2.50\nTotal Amount: $2500.00\nPayment Terms: NET 30\nShipping Terms: CIF\nDestination: Tokyo"
+                return PDF_CONVERSION_FAILED_MOCK_TEXT
             
-            # 各画像をOCR処理
-            all_text = ""
-            for i, image in enumerate(images):
-                logger.info(f"画像 {i+1}/{len(images)} からテキストを抽出しています")
-                
-                # 画像の前処理
-                processed_image = preprocess_image(image)
-                
-                # 複数の方法でOCRを試みる
-                page_text = ""
-                ocr_methods = [
-                    # 方法1: 直接pytesseractを使用
-                    lambda: pytesseract.image_to_string(processed_image, lang='eng'),
-                    
-                    # 方法2: 一時ファイルに保存してから処理
-                    lambda: ocr_with_temp_file(processed_image, temp_dir, i)
-                ]
-                
-                # 各方法を順に試す
-                for method_idx, ocr_method in enumerate(ocr_methods):
-                    try:
-                        logger.info(f"OCR方法 {method_idx+1} を試行中")
-                        page_text = ocr_method()
-                        if page_text:
-                            logger.info(f"方法 {method_idx+1} でテキスト抽出成功 ({len(page_text)} 文字)")
-                            break
-                    except Exception as e:
-                        logger.warning(f"OCR方法 {method_idx+1} が失敗: {str(e)}")
-                
-                all_text += f"\n--- Page {i+1} ---\n{page_text}"
+            # 全ページを1回のtesseract呼び出しでOCR処理
+            page_texts = ocr_pdf_pages_batch(page_paths, temp_dir)
+            
+            # 一括処理に失敗した場合はページごとにOCR処理
+            if page_texts is None:
+                logger.warning("一括OCRに失敗したため、ページごとにOCRを実行します")
+                page_count = len(page_paths)
+                page_texts = run_per_page(
+                    ocr_pdf_page, page_count,
+                    page_paths, repeat(temp_dir), range(page_count), repeat(page_count)
+                )
+            
+            if first_page_text is not None:
+                page_texts = [first_page_text, *page_texts]
+            
+            chunks = []
+            for i, page_text in enumerate(page_texts):
+                chunks.append(f"\n--- Page {i+1} ---\n{page_text}")
                 logger.debug(f"ページ {i+1} の抽出テキスト長: {len(page_text)} 文字")
             
             logger.info("PDFからのテキスト抽出が完了しました")
-            return all_text.strip()
+            return "".join(chunks).strip()
     except Exception as e:
         logger.error(f"PDF処理中にエラーが発生: {str(e)}")
         # エラーが発生した場合もモックデータを返す（UIの動作を停止させないため）
-        return "ERROR MOCK Purchase Order No. 12345\nBuyer's Info: Sample Company\nProduct: Sample Product\nQuantity: 1000kg\nUnit Price: $2.50\nTotal Amount: $2500.00\nPayment Terms: NET 30\nShipping Terms: CIF\nDestination: Tokyo"
+        return PDF_ERROR_MOCK_TEXT
+
+
+def run_per_page(func, page_count: int, *iterables) -> list:
+    """
+    ページ単位の処理を複数スレッドで並列実行（1ページの場合は現在のスレッドで実行）
+    
+    Args:
+        func: ページ単位の処理を行う関数
+        page_count: ページ数
+        *iterables: funcに渡す引数のイテラブル
+        
+    Returns:
+        ページ順に並んだ処理結果のリスト
+    """
+    if page_count <= 1 or OCR_PAGE_WORKERS <= 1:
+        return list(map(func, *iterables))
+    
+    with ThreadPoolExecutor(max_workers=min(OCR_PAGE_WORKERS, page_count)) as executor:
+        return list(executor.map(func, *iterables))
+
+def preprocess_page_file(page_path: str, processed_path: str) -> str:
+    """
+    ページ画像を前処理して保存（前処理で変更がない場合は保存せずに元のファイルを使用）
+    
+    Args:
+        page_path: ページ画像ファイルのパス
+        processed_path: 前処理済み画像の保存先パス
+        
+    Returns:
+        OCRに使用する画像のパス
+    """
+    with Image.open(page_path) as image:
+        processed_image = preprocess_image(image)
+        if processed_image is image:
+            return page_path
+        with processed_image:
+            processed_image.save(processed_path, 'PNG', compress_level=TEMP_PNG_COMPRESS_LEVEL)
+    return processed_path
 
+def preprocess_page_files_gpu(page_paths: List[str], processed_paths: List[str]) -> List[str]:
+    """
+    ページ画像をGPUでまとめて前処理して保存（前処理で変更がない場合は元のファイルを使用）
+    
+    Args:
+        page_paths: ページ画像ファイルのパスのリスト
+        processed_paths: 前処理済み画像の保存先パスのリスト
+        
+    Returns:
+        OCRに使用する画像のパスのリスト
+    """
+    result_paths = []
+    for start in range(0, len(page_paths), GPU_BATCH_PAGES):
+        images = []
+        for page_path in page_paths[start:start + GPU_BATCH_PAGES]:
+            with Image.open(page_path) as image:
+                image.load()
+                images.append(image)
+        
+        processed_images = preprocess_batch_gpu(images)
+        for i, (image, processed_image) in enumerate(zip(images, processed_images), start):
+            if processed_image is image:
+                result_paths.append(page_paths[i])
+            else:
+                with processed_image:
+                    processed_image.save(processed_paths[i], 'PNG', compress_level=TEMP_PNG_COMPRESS_LEVEL)
+                result_paths.append(processed_paths[i])
+            image.close()
+    return result_paths
 
-def try_with_poppler_paths(pdf_path: str, output_folder: str) -> List[Image.Image]:
+def select_pdf_dpi(pdf_path: str) -> Tuple[int, Optional[str]]:
     """
-    異なるpopplerパスを試してPDFを画像に変換
+    1ページ目を低解像度でOCRし、その平均信頼度からPDF変換の解像度を決定
     
     Args:
         pdf_path: PDFファイルのパス
-        output_folder: 出力フォルダ
         
     Returns:
-        PIL Imageのリスト
-    """
-    # 一般的なpopplerインストールパスを試す
-    poppler_paths = [
-        '/usr/bin',
-        '/usr/local/bin',
-        '/opt/homebrew/bin',
-        '/usr/local/Cellar/poppler/21.08.0/bin',
-        'C:\\Program Files\\poppler\\bin',
-        '/opt/poppler/bin',
-        '/app/.apt/usr/bin'  # Heroku環境などでの場所
-    ]
-    
-    for path in poppler_paths:
-        try:
-            logger.info(f"poppler_path試行: {path}")
-            images = convert_from_path(
-                pdf_path,
-                output_folder=output_folder,
-                fmt="png",
-                dpi=300,
-                poppler_path=path
+        PDF変換に使用するDPIと、低解像度を採用した場合の1ページ目のテキスト（高解像度の場合はNone）
+    """
+    try:
+        sample_pages = convert_from_path(
+            pdf_path,
+            dpi=PDF_LOW_DPI,
+            grayscale=True,
+            first_page=1,
+            last_page=1,
+            poppler_path=POPPLER_PATH
+        )
+        with sample_pages[0] as image:
+            data = pytesseract.image_to_data(
+                preprocess_image(image),
+                lang='eng',
+                output_type=pytesseract.Output.DICT
             )
-            if images and len(images) > 0:
-                return images
-        except Exception:
+        
+        # 信頼度-1は単語以外の要素なので除外
+        confidences = [float(conf) for conf in data['conf'] if float(conf) >= 0]
+        mean_confidence = sum(confidences) / len(confidences) if confidences else 0.0
+        logger.info(f"{PDF_LOW_DPI}DPIでの1ページ目の平均信頼度: {mean_confidence:.1f}")
+        
+        if mean_confidence > PDF_LOW_DPI_MIN_CONFIDENCE:
+            return PDF_LOW_DPI, text_from_ocr_data(data)
+    except Exception as e:
+        logger.warning(f"PDF解像度の判定に失敗: {str(e)}")
+    
+    return PDF_HIGH_DPI, None
+
+def text_from_ocr_data(data: Dict[str, List[Any]]) -> str:
+    """
+    pytesseract.image_to_dataの結果からテキストを組み立てる（image_to_stringと同じ改行の付け方）
+    
+    Args:
+        data: image_to_dataの結果（Output.DICT）
+        
+    Returns:
+        抽出されたテキスト
+    """
+    paragraphs: List[List[List[str]]] = []
+    last_paragraph = last_line = None
+    for i, word in enumerate(data['text']):
+        if data['level'][i] != 5 or not word or not word.strip():
             continue
+        paragraph = (data['page_num'][i], data['block_num'][i], data['par_num'][i])
+        line = paragraph + (data['line_num'][i],)
+        if paragraph != last_paragraph:
+            paragraphs.append([])
+            last_paragraph = paragraph
+            last_line = None
+        if line != last_line:
+            paragraphs[-1].append([])
+            last_line = line
+        paragraphs[-1][-1].append(word)
+    
+    # 行は改行、段落は空行で区切る
+    return "\n\n".join(
+        "\n".join(" ".join(words) for words in lines) for lines in paragraphs
+    ) + ("\n" if paragraphs else "")
+
+def get_pdf_page_count(pdf_path: str) -> Optional[int]:
+    """
+    PDFのページ数を取得
+    
+    Args:
+        pdf_path: PDFファイルのパス
+        
+    Returns:
+        ページ数（取得できなかった場合はNone）
+    """
+    try:
+        return int(pdfinfo_from_path(pdf_path, poppler_path=POPPLER_PATH)["Pages"])
+    except Exception as e:
+        logger.warning(f"PDFのページ数の取得に失敗: {str(e)}")
+        return None
+
+def tesseract_single_stream_env() -> Dict[str, str]:
+    """
+    1回の呼び出しで全ページを処理するtesseract用の環境変数を返す（OpenMPスレッドをページ並列数まで使用する）
+    """
+    return {**os.environ, "OMP_THREAD_LIMIT": str(OCR_PAGE_WORKERS)}
+
+def ocr_pdf_pipeline(pdf_path: str, dpi: int) -> Optional[str]:
+    """
+    pdftoppmのTIFF出力をパイプでtesseractに渡してOCR処理（1ページのPDF用）
+    
+    Args:
+        pdf_path: PDFファイルのパス
+        dpi: 変換解像度
+        
+    Returns:
+        抽出されたテキスト（失敗した場合はNone）
+    """
+    pdftoppm_cmd = os.path.join(POPPLER_PATH, "pdftoppm") if POPPLER_PATH else "pdftoppm"
+    pdftoppm = None
+    tesseract = None
+    try:
+        pdftoppm = subprocess.Popen(
+            [pdftoppm_cmd, "-r", str(dpi), "-gray", "-tiff", "-singlefile", pdf_path, "-"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        try:
+            tesseract = subprocess.Popen(
+                [pytesseract.pytesseract.tesseract_cmd, "-", "-", "-l", "eng"],
+                stdin=pdftoppm.stdout,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                encoding="utf-8",
+                env=tesseract_single_stream_env()
+            )
+        finally:
+            # tesseractが終了した場合にpdftoppmがSIGPIPEを受け取れるよう、こちら側の読み口は閉じる
+            pdftoppm.stdout.close()
+        try:
+            text, error = tesseract.communicate(timeout=OCR_PIPELINE_TIMEOUT)
+            pdftoppm.wait(timeout=OCR_PIPELINE_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"パイプラインでのOCRがタイムアウトしました ({OCR_PIPELINE_TIMEOUT}秒)")
+            return None
+        
+        if pdftoppm.returncode != 0 or tesseract.returncode != 0:
+            logger.warning(
+                f"パイプラインでのOCRが失敗: pdftoppm={pdftoppm.returncode}, "
+                f"tesseract={tesseract.returncode}, {error.strip()}"
+            )
+            return None
+        
+        # 出力末尾のフォームフィード(\f)を除く
+        return text.split("\f")[0]
+    except Exception as e:
+        logger.warning(f"パイプラインでのOCRが失敗: {str(e)}")
+        return None
+    finally:
+        # タイムアウトや起動失敗の場合にプロセスが残らないよう終了させる
+        for process in (tesseract, pdftoppm):
+            if process is None:
+                continue
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            for stream in (process.stdout, process.stderr):
+                if stream is not None:
+                    stream.close()
+
+def ocr_pdf_pages_batch(page_paths: List[str], temp_dir: str) -> Optional[List[str]]:
+    """
+    前処理済みのページ画像をリストファイルにまとめ、1回のtesseract呼び出しでOCR処理
+    
+    Args:
+        page_paths: ページ画像ファイルのパスのリスト
+        temp_dir: 一時ディレクトリのパス
+        
+    Returns:
+        ページごとの抽出テキストのリスト（失敗した場合はNone）
+    """
+    try:
+        processed_paths = [os.path.join(temp_dir, f"processed_{i}.png") for i in range(len(page_paths))]
+        
+        # GPUが使用可能で複数ページの場合はGPUでまとめて前処理（失敗時はCPUで処理）
+        ocr_paths = None
+        if len(page_paths) >= 2 and gpu_available():
+            try:
+                ocr_paths = preprocess_page_files_gpu(page_paths, processed_paths)
+            except Exception as e:
+                logger.warning(f"GPUでの前処理が失敗したためCPUで処理します: {str(e)}")
+        if ocr_paths is None:
+            ocr_paths = run_per_page(preprocess_page_file, len(page_paths), page_paths, processed_paths)
+        processed_paths = ocr_paths
+        
+        # tesseractは.txtの入力を画像パスのリストとして扱う
+        list_path = os.path.join(temp_dir, "image_list.txt")
+        with open(list_path, "w") as list_file:
+            list_file.write("\n".join(processed_paths) + "\n")
+        
+        logger.info(f"{len(processed_paths)}ページを一括でOCR処理しています")
+        # 結果は標準出力で受け取る（pytesseract経由の出力ファイルの書き込み・読み込みを省略）
+        result = subprocess.run(
+            [pytesseract.pytesseract.tesseract_cmd, list_path, "-", "-l", "eng"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            encoding="utf-8",
+            env=tesseract_single_stream_env(),
+            check=True
+        )
+        text = result.stdout
+        
+        # ページはフォームフィード(\f)で区切られる
+        page_texts = text.split("\f")
+        if len(page_texts) == len(processed_paths) + 1 and not page_texts[-1].strip():
+            page_texts = page_texts[:-1]
+        
+        if len(page_texts) != len(processed_paths):
+            logger.warning(f"一括OCRのページ数が一致しません: 期待={len(processed_paths)}, 結果={len(page_texts)}")
+            return None
+        
+        logger.info("一括OCRでテキスト抽出成功")
+        return page_texts
+    except Exception as e:
+        logger.warning(f"一括OCRが失敗: {str(e)}")
+        return None
+
+def ocr_pdf_page(page_path: str, temp_dir: str, page_num: int, page_count: int) -> str:
+    """
+    PDFの1ページ分の画像からテキストを抽出
+    
+    Args:
+        page_path: ページ画像ファイルのパス
+        temp_dir: 一時ディレクトリのパス
+        page_num: ページ番号（0始まり）
+        page_count: 総ページ数
+        
+    Returns:
+        抽出されたテキスト
+    """
+    logger.info(f"画像 {page_num+1}/{page_count} からテキストを抽出しています")
+    
+    # 1ページずつ読み込み、OCR後に解放する
+    with Image.open(page_path) as image:
+        # 画像の前処理
+        processed_image = preprocess_image(image)
+        
+        # PIL画像を直接pytesseractに渡し、例外が発生した場合のみ一時ファイル経由で再試行
+        try:
+            page_text = pytesseract.image_to_string(
+                processed_image, lang='eng', output_type=pytesseract.Output.STRING
+            )
+            logger.info(f"テキスト抽出成功 ({len(page_text)} 文字)")
+        except Exception as e:
+            logger.warning(f"OCRが失敗したため一時ファイル経由で再試行: {str(e)}")
+            page_text = ocr_with_temp_file(processed_image, temp_dir, page_num)
+        finally:
+            if processed_image is not image:
+                processed_image.close()
+    
+    # OCR済みのページ画像は一時ディレクトリの削除を待たずに削除する
+    try:
+        os.unlink(page_path)
+    except OSError as e:
+        logger.debug(f"ページ画像の削除に失敗: {str(e)}")
     
-    raise OCRError("利用可能なpoppler_pathが見つかりません")
+    return page_text
 
-def convert_with_imagemagick(pdf_path: str, output_folder: str) -> List[Image.Image]:
+def convert_with_imagemagick(pdf_path: str, output_folder: str, dpi: int = PDF_HIGH_DPI) -> List[str]:
     """
     ImageMagickを使用してPDFを画像に変換
     
     Args:
         pdf_path: PDFファイルのパス
         output_folder: 出力フォルダ
+        dpi: 変換時の解像度
         
     Returns:
-        PIL Imageのリスト
+        変換された画像ファイルのパスのリスト
     """
     try:
         # ImageMagickのconvertコマンドを実行
         logger.info("ImageMagickでPDFを変換")
         output_pattern = os.path.join(output_folder, "page_%d.png")
-        os.system(f"convert -density 300 '{pdf_path}' '{output_pattern}'")
+        try:
+            subprocess.run(
+                [*IMAGEMAGICK_COMMAND, "-density", str(dpi), pdf_path, "-quality", IMAGEMAGICK_PNG_QUALITY, output_pattern],
+                check=True,
+                timeout=IMAGEMAGICK_TIMEOUT,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE
+            )
+        except subprocess.TimeoutExpired:
+            raise OCRError(f"ImageMagickでの変換がタイムアウトしました ({IMAGEMAGICK_TIMEOUT}秒)")
+        except subprocess.CalledProcessError as e:
+            stderr = e.stderr.decode(errors="replace").strip() if e.stderr else ""
+            raise OCRError(f"ImageMagickでの変換に失敗しました: {stderr}")
         
-        # 生成された画像ファイルを確認
-        image_files = [f for f in os.listdir(output_folder) if f.endswith('.png')]
+        # 生成された画像ファイルを確認（page_<番号>.png のみ）
+        page_files = []
+        for f in os.listdir(output_folder):
+            match = IMAGEMAGICK_PAGE_FILE_RE.fullmatch(f)
+            if match:
+                page_files.append((int(match.group(1)), f))
         
-        if not image_files:
+        if not page_files:
             raise OCRError("ImageMagickでの変換結果が見つかりません")
         
-        # 画像ファイルを読み込む
-        images = []
-        for img_file in sorted(image_files):
-            img_path = os.path.join(output_folder, img_file)
-            images.append(Image.open(img_path))
+        # ページ番号の数値順に並べる（文字列順では page_10 が page_2 より前になる）
+        page_files.sort()
         
-        return images
+        # 画像ファイルのパスを返す（読み込みはOCR時に行う）
+        return [os.path.join(output_folder, f) for _, f in page_files]
     except Exception as e:
         logger.error(f"ImageMagickでの変換エラー: {str(e)}")
         raise
@@ -379,113 +1039,98 @@ def ocr_with_temp_file(image, temp_dir: str, page_num: int) -> str:
     Returns:
         抽出されたテキスト
     """
-    temp_image_path = os.path.join(temp_dir, f"page_{page_num}.png")
-    image.save(temp_image_path, 'PNG')
+    # ImageMagickの出力（page_%d.png）や他のスレッドが処理中のページ画像と名前が重ならないようにする
+    temp_image_path = os.path.join(temp_dir, f"fallback_{page_num}.png")
+    image.save(temp_image_path, 'PNG', compress_level=TEMP_PNG_COMPRESS_LEVEL)
     
-    # 複数の言語オプションを試す
-    lang_options = ['eng', 'eng+jpn', 'jpn+eng']
+    # まず英語のみで試し、意味のあるテキストが得られない場合のみ日本語を追加する
+    lang_options = [OCR_DEFAULT_LANG]
+    if tesseract_has_japanese():
+        lang_options.append(OCR_JAPANESE_LANG)
     
-    for lang in lang_options:
-        try:
-            logger.info(f"言語オプション '{lang}' でOCRを試行")
-            text = pytesseract.image_to_string(temp_image_path, lang=lang)
-            if text and len(text.strip()) > 10:  # 意味のあるテキストが抽出できたか
-                return text
-        except Exception as e:
-            logger.warning(f"言語 '{lang}' でのOCR失敗: {str(e)}")
+    try:
+        for lang in lang_options:
+            try:
+                logger.info(f"言語オプション '{lang}' でOCRを試行")
+                text = pytesseract.image_to_string(temp_image_path, lang=lang)
+                if text and len(text.strip()) > 10:  # 意味のあるテキストが抽出できたか
+                    return text
+            except Exception as e:
+                logger.warning(f"言語 '{lang}' でのOCR失敗: {str(e)}")
+    finally:
+        os.unlink(temp_image_path)
     
     # すべての方法が失敗した場合
     return ""
 
-def process_image(image_path: str) -> str:
+def tesseract_has_japanese() -> bool:
     """
-    画像ファイルからテキストを抽出
+    tesseractに日本語の学習データがインストールされているかを返す（初回のみ確認）
     
-    Args:
-        image_path: 画像ファイルのパス
-        
     Returns:
-        抽出されたテキスト
+        日本語（jpn）が使用可能な場合はTrue
     """
-    logger.info(f"画像処理開始: {image_path}")
-    
-    try:
-        # PILを使用して画像を開く
-        with Image.open(image_path) as img:
-            # 画像の前処理
-            processed_image = preprocess_image(img)
-            
-            # 複数の方法でOCRを試みる
-            text = ""
-            ocr_methods = [
-                # 方法1: 直接pytesseractを使用
-                lambda: pytesseract.image_to_string(processed_image, lang='eng'),
-                
-                # 方法2: 一時ファイルに保存してから処理
-                lambda: ocr_image_with_temp_file(processed_image)
-            ]
-            
-            # 各方法を順に試す
-            for method_idx, ocr_method in enumerate(ocr_methods):
-                try:
-                    logger.info(f"画像OCR方法 {method_idx+1} を試行中")
-                    text = ocr_method()
-                    if text:
-                        logger.info(f"方法 {method_idx+1} でテキスト抽出成功 ({len(text)} 文字)")
-                        break
-                except Exception as e:
-                    logger.warning(f"画像OCR方法 {method_idx+1} が失敗: {str(e)}")
-            
-            if not text:
-                logger.warning("すべてのOCR方法が失敗しました")
-                text = ""
-                
-            logger.info("画像からのテキスト抽出が完了しました")
-            return text.strip()
-    except Exception as e:
-        logger.error(f"画像処理中にエラーが発生: {str(e)}")
-        raise OCRError(f"画像処理中にエラーが発生: {str(e)}")
+    global _tesseract_has_jpn
+    if _tesseract_has_jpn is None:
+        try:
+            _tesseract_has_jpn = 'jpn' in pytesseract.get_languages(config='')
+        except Exception as e:
+            logger.warning(f"tesseractの言語一覧の取得に失敗: {str(e)}")
+            _tesseract_has_jpn = False
+    return _tesseract_has_jpn
 
-def ocr_image_with_temp_file(image) -> str:
+def process_image(image_path: str) -> str:
     """
-    画像を一時ファイルに保存してからOCR処理
+    画像ファイルからテキストを抽出
     
     Args:
-        image: PIL Imageオブジェクト
+        image_path: 画像ファイルのパス
         
     Returns:
         抽出されたテキスト
     """
-    with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as temp_file:
-        temp_path = temp_file.name
+    logger.info(f"画像処理開始: {image_path}")
     
     try:
-        image.save(temp_path, 'PNG')
+        # PILを使用して画像を開き、グレースケール・縮小デコード（JPEGのみ有効）した上で読み込む
+        # （読み込み後はOCR処理の間ファイルを開いたままにしない）
+        with Image.open(image_path) as img:
+            img.draft('L', IMAGE_DRAFT_SIZE)
+            img.load()
         
-        # 複数の言語オプションを試す
-        lang_options = ['eng', 'eng+jpn', 'jpn+eng']
+        # 画像の前処理
+        processed_image = preprocess_image(img)
         
-        for lang in lang_options:
+        # PIL画像を直接pytesseractに渡し、例外が発生した場合のみRGBに変換して再試行（画像モードに起因するエラー対策）
+        text = ""
+        try:
+            text = pytesseract.image_to_string(
+                processed_image, lang='eng', output_type=pytesseract.Output.STRING
+            )
+        except Exception as e:
+            logger.warning(f"画像OCRが失敗したためRGBに変換して再試行: {str(e)}")
             try:
-                logger.info(f"言語オプション '{lang}' でOCRを試行")
-                text = pytesseract.image_to_string(temp_path, lang=lang)
-                if text and len(text.strip()) > 10:  # 意味のあるテキストが抽出できたか
-                    return text
+                text = pytesseract.image_to_string(
+                    processed_image.convert('RGB'), lang='eng', output_type=pytesseract.Output.STRING
+                )
             except Exception as e:
-                logger.warning(f"言語 '{lang}' でのOCR失敗: {str(e)}")
+                logger.warning(f"RGB変換後の画像OCRも失敗: {str(e)}")
         
-        # すべての方法が失敗した場合
-        return ""
-    finally:
-        # 一時ファイルを削除
-        if os.path.exists(temp_path):
-            os.unlink(temp_path)
+        if not text:
+            logger.warning("すべてのOCR方法が失敗しました")
+            text = ""
+            
+        logger.info("画像からのテキスト抽出が完了しました")
+        return text.strip()
+    except Exception as e:
+        logger.error(f"画像処理中にエラーが発生: {str(e)}")
+        raise OCRError(f"画像処理中にエラーが発生: {str(e)}")
 
 def update_ocr_result(
     db: Session, 
     ocr_id: int, 
     raw_text: str, 
-    processed_data: str, 
+    processed_data: Union[str, Dict[str, Any]], 
     status: str, 
     error_message: str = None
 ):
@@ -496,32 +1141,40 @@ def update_ocr_result(
         db: データベースセッション
         ocr_id: OCR結果のID
         raw_text: 抽出されたテキスト
-        processed_data: 処理済みデータ（JSON文字列）
+        processed_data: 処理済みデータ（JSON文字列または辞書）
         status: 処理状態
         error_message: エラーメッセージ（オプション）
     """
     try:
-        ocr_result = db.query(models.OCRResult).filter(models.OCRResult.ocr_id == ocr_id).first()
-        
-        if ocr_result:
-            ocr_result.raw_text = raw_text
-            ocr_result.processed_data = processed_data
-            ocr_result.status = status
-            
-            if error_message:
-                # エラーメッセージがあれば保存
+        if error_message:
+            # エラーメッセージがあれば処理済みデータに追加
+            if isinstance(processed_data, str):
                 try:
-                    error_data = json.loads(processed_data) if processed_data and processed_data != "{}" else {}
-                    error_data["error"] = error_message
-                    ocr_result.processed_data = json.dumps(error_data)
-                except json.JSONDecodeError:
+                    processed_data = orjson.loads(processed_data) if processed_data not in EMPTY_PROCESSED_DATA else {}
+                except orjson.JSONDecodeError:
                     # JSON解析エラーの場合は新しいJSONを作成
-                    ocr_result.processed_data = json.dumps({"error": error_message})
-            
-            db.commit()
-            logger.info(f"OCR結果更新: ID={ocr_id}, ステータス={status}")
-        else:
+                    processed_data = {}
+            processed_data = {**processed_data, "error": error_message}
+        
+        # 辞書の場合はここで1回だけJSONに変換
+        if isinstance(processed_data, dict):
+            processed_data = orjson.dumps(processed_data).decode()
+        
+        # SELECTせずに1回のUPDATE文で更新
+        stmt = (
+            update(models.OCRResult)
+            .where(models.OCRResult.ocr_id == ocr_id)
+            .values(raw_text=raw_text, processed_data=processed_data, status=status)
+        )
+        result = db.execute(stmt)
+        
+        if result.rowcount == 0:
             logger.warning(f"OCR結果更新失敗: ID={ocr_id} が見つかりません")
+            db.rollback()
+            return
+        
+        db.commit()
+        logger.info(f"OCR結果更新: ID={ocr_id}, ステータス={status}")
     
     except Exception as e:
         logger.error(f"OCR結果更新中にエラー: {e}")
@@ -544,7 +1197,7 @@ def process_po_file(file_path: str) -> Dict[str, Any]:
         ocr_text = process_document(file_path)
         
         # POデータの抽出
-        po_data = extract_po_data(ocr_text)
+        po_data = extract_po_data_cached(ocr_text)
         
         processing_time = time.time() - start_time
         
@@ -553,7 +1206,7 @@ def process_po_file(file_path: str) -> Dict[str, Any]:
             "status": "completed",
             "data": po_data,
             "processing_time": processing_time,
-            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+            "timestamp": time.strftime(TIMESTAMP_FMT)
         }
     except Exception as e:
         logger.error(f"POファイル処理エラー: {str(e)}")
@@ -561,7 +1214,7 @@ def process_po_file(file_path: str) -> Dict[str, Any]:
             "id": str(uuid.uuid4()),
             "status": "error",
             "error": str(e),
-            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+            "timestamp": time.strftime(TIMESTAMP_FMT)
         }
 
 # 以下の関数は実際のデータベース接続で置き換えるため、非推奨とマーク
@@ -1,36 +1,93 @@
 # startup.py - Azure App Service用スタートアップスクリプト
 import os
+import re
 import sys
 import subprocess
 import logging
-import time
-import shutil
-from pathlib import Path
+import hashlib
+import importlib.metadata
+import sysconfig
 
 # ロギング設定
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    force=True
 )
 logger = logging.getLogger("startup")
 
+# パスの存在確認結果（起動中に同じパスを何度も確認するため）
+_exists_cache = {}
+
+# カレントディレクトリに見つからない場合に確認する既知のパス
+ALT_REQ_PATHS = (
+    "/home/site/wwwroot/requirements.txt",
+    "/tmp/8dd6c400210b5d5/requirements.txt"
+)
+ALT_APP_PATHS = (
+    "/home/site/wwwroot/app.py",
+    "/tmp/8dd6c400210b5d5/app.py"
+)
+
+# このバージョン以上のpipがあれば更新しない（確認済みであることをセンチネルファイルで記録）
+PIP_MIN_VERSION = (23, 0)
+PIP_OK_SENTINEL = "/tmp/.pip_ok"
+
+# 再起動後も残る場所にpipのキャッシュを置く
+PIP_CACHE_DIR = "/home/site/wwwroot/.pip-cache"
+# ソースからのビルド（Cコンパイル）に時間がかかるため、必ずwheelを使用するパッケージ
+PIP_ONLY_BINARY_PACKAGES = "cryptography,pillow,opencv-python-headless,numpy"
+
+# requirements.txtのバージョン固定行（name[extras]==version）とパッケージ名
+PINNED_REQUIREMENT_RE = re.compile(r"([A-Za-z0-9._-]+)(?:\[([A-Za-z0-9._,\s-]+)\])?==([A-Za-z0-9.+!-]+)")
+REQUIREMENT_NAME_RE = re.compile(r"[A-Za-z0-9._-]+")
+
+# 診断スクリプトの終了を待つ最大時間（秒）
+DIAGNOSIS_TIMEOUT = 30
+
+# gunicornのワーカー数の既定値（ジョブの状態は各ワーカーのjobs_statusに保持され、
+# DB接続プールもワーカーごとに作成されるため、CPU数に応じて増やさない）
+DEFAULT_WORKER_COUNT = 2
+
+# インストール済みのrequirements.txtのハッシュ（内容が変わっていなければpipを実行しない）
+REQUIREMENTS_HASH_FILE = os.path.join(sys.prefix, ".reqs.sha256")
+
+def _exists(path):
+    """パスの存在を確認する（結果は起動処理の間キャッシュする）"""
+    path = os.path.abspath(path)
+    exists = _exists_cache.get(path)
+    if exists is None:
+        exists = _exists_cache[path] = os.path.exists(path)
+    return exists
+
+def _first_existing(paths):
+    """存在する最初のパスを返す（見つからなければNone）"""
+    return next((path for path in paths if _exists(path)), None)
+
+def _mkdir(path):
+    """ディレクトリを作成し、存在確認のキャッシュを更新する（親ディレクトリは存在していること）"""
+    try:
+        os.mkdir(path)
+    except FileExistsError:
+        pass
+    _exists_cache[os.path.abspath(path)] = True
+
 def check_system_libraries():
     """システムライブラリの存在を確認する関数"""
     logger.info("=============== システムライブラリの確認 ===============")
-    import subprocess
     import shutil
 
     # poppler-utilsの確認
     pdftoppm_path = shutil.which("pdftoppm")
     if pdftoppm_path:
-        logger.info(f"pdftoppm (poppler-utils) が見つかりました: {pdftoppm_path}")
+        logger.info("pdftoppm (poppler-utils) が見つかりました: %s", pdftoppm_path)
     else:
         logger.warning("pdftoppm (poppler-utils) が見つかりません。OCR機能は正常に動作しない可能性があります。")
 
     # tesseract-ocrの確認
     tesseract_path = shutil.which("tesseract")
     if tesseract_path:
-        logger.info(f"tesseract が見つかりました: {tesseract_path}")
+        logger.info("tesseract が見つかりました: %s", tesseract_path)
     else:
         logger.warning("tesseract が見つかりません。OCR機能は正常に動作しない可能性があります。")
 
@@ -49,24 +106,40 @@ def check_system_libraries():
 
     logger.info("=============== システムライブラリの確認完了 ===============")
 
+def setup_pip_environment():
+    """pipの環境変数を設定する関数（明示的に設定されている値は変更しない）"""
+    os.environ.setdefault("PIP_PREFER_BINARY", "1")
+    os.environ.setdefault("PIP_ONLY_BINARY", PIP_ONLY_BINARY_PACKAGES)
+    
+    if "PIP_CACHE_DIR" not in os.environ and _exists(os.path.dirname(PIP_CACHE_DIR)):
+        try:
+            _mkdir(PIP_CACHE_DIR)
+            os.environ["PIP_CACHE_DIR"] = PIP_CACHE_DIR
+            logger.info("pipキャッシュディレクトリ: %s", PIP_CACHE_DIR)
+        except OSError as e:
+            logger.warning("pipキャッシュディレクトリの作成に失敗しました: %s", e)
+
 def setup_environment():
     """環境設定を行う関数"""
     logger.info("=============== 環境設定開始 ===============")
     
+    # pipの設定（ビルド済みのwheelを使用し、再起動後もキャッシュを再利用する）
+    setup_pip_environment()
+    
     # 現在の作業ディレクトリを確認
     current_dir = os.getcwd()
-    logger.info(f"現在の作業ディレクトリ: {current_dir}")
+    logger.info("現在の作業ディレクトリ: %s", current_dir)
     
     # 必要なディレクトリ作成
     tmp_dir = "/tmp"
     ocr_temp_dir = os.path.join(tmp_dir, "ocr_temp")
     upload_dir = os.path.join(tmp_dir, "uploads")
     
-    os.makedirs(ocr_temp_dir, exist_ok=True)
-    os.makedirs(upload_dir, exist_ok=True)
+    _mkdir(ocr_temp_dir)
+    _mkdir(upload_dir)
     
-    logger.info(f"OCR一時ディレクトリ作成: {ocr_temp_dir}")
-    logger.info(f"アップロードディレクトリ作成: {upload_dir}")
+    logger.info("OCR一時ディレクトリ作成: %s", ocr_temp_dir)
+    logger.info("アップロードディレクトリ作成: %s", upload_dir)
     
     # 環境変数設定
     os.environ["UPLOAD_FOLDER"] = upload_dir
@@ -74,18 +147,13 @@ def setup_environment():
     
     # requirements.txtが存在するか確認
     req_file = os.path.join(current_dir, "requirements.txt")
-    if not os.path.exists(req_file):
-        logger.warning(f"requirements.txt が見つかりません: {req_file}")
+    if not _exists(req_file):
+        logger.warning("requirements.txt が見つかりません: %s", req_file)
         # 既知のパスをチェック
-        alternative_paths = [
-            "/home/site/wwwroot/requirements.txt",
-            "/tmp/8dd6c400210b5d5/requirements.txt"
-        ]
-        for alt_path in alternative_paths:
-            if os.path.exists(alt_path):
-                logger.info(f"代替 requirements.txt を見つけました: {alt_path}")
-                req_file = alt_path
-                break
+        alt_path = _first_existing(ALT_REQ_PATHS)
+        if alt_path:
+            logger.info("代替 requirements.txt を見つけました: %s", alt_path)
+            req_file = alt_path
     
     logger.info("=============== 環境設定完了 ===============")
     return current_dir, req_file
@@ -95,22 +163,147 @@ def install_dependencies(req_file):
     logger.info("=============== 依存パッケージインストール開始 ===============")
     
     # requirements.txtが存在するか再確認
-    if os.path.exists(req_file):
-        logger.info(f"requirements.txt からインストール: {req_file}")
+    if _exists(req_file):
+        # 前回インストール時から内容が変わっていなければスキップ
+        req_hash = get_requirements_hash(req_file)
+        if is_requirements_installed(req_hash):
+            logger.info("requirements.txt に変更がないため、依存パッケージのインストールをスキップします")
+            return
+        
+        # インストール済みのパッケージと比較し、不足しているものだけをインストールする
+        missing = find_missing_requirements(req_file)
+        # pip checkはサブプロセスで実行する（pipの更新前にpipをこのプロセスへインポートしないため）
+        if missing == [] and subprocess.run([sys.executable, "-m", "pip", "check"]).returncode == 0:
+            logger.info("requirements.txt のパッケージはすべてインストール済みです")
+            save_requirements_hash(req_hash)
+            return
+        
+        logger.info("requirements.txt からインストール: %s", req_file)
         try:
-            subprocess.run([sys.executable, "-m", "pip", "install", "--upgrade", "pip"], check=True)
-            subprocess.run([sys.executable, "-m", "pip", "install", "-r", req_file], check=True)
+            # pip自身の更新は読み込み済みのpipと混在しないよう別プロセスで実行する
+            if is_pip_up_to_date():
+                logger.info("pip は十分に新しいため、更新をスキップします")
+            else:
+                subprocess.run([sys.executable, "-m", "pip", "install", "--upgrade", "pip"], check=True)
+                mark_pip_up_to_date()
+            if missing:
+                logger.info("不足しているパッケージのみインストールします: %s", ' '.join(missing))
+                run_pip(["install", *missing], check=True)
+            else:
+                run_pip(["install", "-r", req_file], check=True)
+            save_requirements_hash(req_hash)
             logger.info("依存パッケージのインストールが完了しました")
         except subprocess.CalledProcessError as e:
-            logger.error(f"依存パッケージのインストールに失敗しました: {e}")
+            logger.error("依存パッケージのインストールに失敗しました: %s", e)
             # フォールバック: 直接インストール
             install_core_dependencies()
     else:
-        logger.warning(f"requirements.txt が見つかりません。直接インストールを実行します。")
+        logger.warning("requirements.txt が見つかりません。直接インストールを実行します。")
         install_core_dependencies()
     
+    # パッケージを更新した場合のみ、ワーカーの初回インポート前にバイトコードを生成しておく
+    precompile_site_packages()
+    
     logger.info("=============== 依存パッケージインストール完了 ===============")
 
+def precompile_site_packages():
+    """site-packagesのバイトコード生成をバックグラウンドで開始する関数"""
+    site_packages = sysconfig.get_paths()["purelib"]
+    logger.info("バイトコードの生成をバックグラウンドで開始します: %s", site_packages)
+    try:
+        subprocess.Popen(
+            [sys.executable, "-m", "compileall", "-j", "0", "-q", site_packages],
+            stdout=subprocess.DEVNULL
+        )
+    except OSError as e:
+        logger.warning("バイトコードの生成を開始できませんでした: %s", e)
+
+def find_missing_requirements(req_file):
+    """
+    requirements.txtのうち、インストールされていないかバージョンが異なる行を返す関数
+    （バージョン固定以外の指定など、判定できない行がある場合はNoneを返す）
+    """
+    missing = []
+    try:
+        with open(req_file) as f:
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                if not line:
+                    continue
+                match = PINNED_REQUIREMENT_RE.fullmatch(line)
+                if not match:
+                    return None
+                name, extras, version = match.groups()
+                if not is_requirement_satisfied(name, extras, version):
+                    missing.append(line)
+    except Exception as e:
+        logger.warning("インストール済みパッケージの確認に失敗しました: %s", e)
+        return None
+    return missing
+
+def is_requirement_satisfied(name, extras, version):
+    """パッケージ（とextrasの依存パッケージ）が指定バージョンでインストール済みかを確認する関数"""
+    try:
+        if importlib.metadata.version(name) != version:
+            return False
+        for extra in (extras.split(",") if extras else []):
+            extra_marker = re.compile(r"extra\s*==\s*['\"]%s['\"]" % re.escape(extra.strip()))
+            for requirement in importlib.metadata.requires(name) or []:
+                if extra_marker.search(requirement):
+                    importlib.metadata.distribution(REQUIREMENT_NAME_RE.match(requirement).group(0))
+        return True
+    except importlib.metadata.PackageNotFoundError:
+        return False
+
+def is_pip_up_to_date():
+    """pipのバージョンが要求を満たしているかを確認する関数"""
+    if _exists(PIP_OK_SENTINEL):
+        return True
+    try:
+        version = importlib.metadata.version("pip")
+        if tuple(int(part) for part in version.split(".")[:2]) < PIP_MIN_VERSION:
+            return False
+    except (importlib.metadata.PackageNotFoundError, ValueError):
+        return False
+    mark_pip_up_to_date()
+    return True
+
+def mark_pip_up_to_date():
+    """pipの確認結果を保存し、次回以降の起動で確認を省略する関数"""
+    try:
+        with open(PIP_OK_SENTINEL, "w"):
+            pass
+        _exists_cache[PIP_OK_SENTINEL] = True
+    except OSError as e:
+        logger.warning("pipの確認結果の保存に失敗しました: %s", e)
+
+def get_requirements_hash(req_file):
+    """requirements.txtの内容のSHA-256ハッシュを返す関数"""
+    with open(req_file, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def is_requirements_installed(req_hash):
+    """同じ内容のrequirements.txtでインストール済みかを確認する関数"""
+    try:
+        with open(REQUIREMENTS_HASH_FILE) as f:
+            if f.read().strip() != req_hash:
+                return False
+        # ハッシュが一致しても、パッケージが実際に存在することを確認
+        importlib.metadata.distribution("fastapi")
+        return True
+    except (OSError, importlib.metadata.PackageNotFoundError):
+        return False
+
+def save_requirements_hash(req_hash):
+    """インストールしたrequirements.txtのハッシュを保存する関数"""
+    tmp_path = f"{REQUIREMENTS_HASH_FILE}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            f.write(req_hash)
+        os.replace(tmp_path, REQUIREMENTS_HASH_FILE)
+    except OSError as e:
+        logger.warning("requirements.txt のハッシュの保存に失敗しました: %s", e)
+
 def install_core_dependencies():
     """コア依存パッケージを直接インストールする関数"""
     logger.info("コア依存パッケージを直接インストールします")
@@ -135,15 +328,55 @@ def install_core_dependencies():
         "cryptography==41.0.3",
         "pyopenssl==23.2.0",
         "numpy==1.26.4",
-        "opencv-python-headless==4.9.0.80"
+        "opencv-python-headless==4.9.0.80",
+        "orjson==3.9.10"
     ]
     
-    for package in core_packages:
+    # 1回のpip呼び出しでまとめてインストール（依存関係の解決も1回で済む）
+    logger.info("インストール中: %s", ' '.join(core_packages))
+    returncode = run_pip(["install", "--no-input", "--disable-pip-version-check", *core_packages])
+    if returncode != 0:
+        logger.error("コア依存パッケージのインストールに失敗しました (終了コード: %s)", returncode)
+
+def run_pip(args, check=False):
+    """pipを実行する関数（可能であれば現在のプロセス内で実行し、インタプリタの起動を省く）"""
+    try:
+        from pip._internal.cli.main import main as pip_main
+    except ImportError:
+        pip_main = None
+    
+    if pip_main is None:
+        returncode = subprocess.run([sys.executable, "-m", "pip", *args]).returncode
+    else:
+        # pipが変更するsys.argv、作業ディレクトリ、ルートロガーの設定を元に戻す
+        argv = sys.argv[:]
+        cwd = os.getcwd()
+        root_logger = logging.getLogger()
+        root_handlers = root_logger.handlers[:]
+        root_level = root_logger.level
         try:
-            logger.info(f"インストール中: {package}")
-            subprocess.run([sys.executable, "-m", "pip", "install", package], check=True)
-        except subprocess.CalledProcessError as e:
-            logger.error(f"パッケージのインストールに失敗しました: {package} - {e}")
+            returncode = pip_main(list(args))
+        except SystemExit as e:
+            returncode = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        finally:
+            sys.argv = argv
+            os.chdir(cwd)
+            root_logger.handlers = root_handlers
+            root_logger.setLevel(root_level)
+    
+    if check and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, ["pip", *args])
+    return returncode
+
+def get_worker_count():
+    """gunicornのワーカー数を返す関数（WEB_CONCURRENCYが設定されていればその値を使用）"""
+    web_concurrency = os.environ.get("WEB_CONCURRENCY")
+    if web_concurrency:
+        try:
+            return max(1, int(web_concurrency))
+        except ValueError:
+            logger.warning("WEB_CONCURRENCY の値が不正です: %s", web_concurrency)
+    return DEFAULT_WORKER_COUNT
 
 def start_application(app_dir):
     """アプリケーションを起動する関数"""
@@ -151,51 +384,73 @@ def start_application(app_dir):
     
     # アプリケーションファイルの確認
     app_file = os.path.join(app_dir, "app.py")
-    if not os.path.exists(app_file):
-        logger.error(f"アプリケーションファイルが見つかりません: {app_file}")
+    if not _exists(app_file):
+        logger.error("アプリケーションファイルが見つかりません: %s", app_file)
         # 既知のパスをチェック
-        alternative_paths = [
-            "/home/site/wwwroot/app.py",
-            "/tmp/8dd6c400210b5d5/app.py"
-        ]
-        for alt_path in alternative_paths:
-            if os.path.exists(alt_path):
-                logger.info(f"代替アプリケーションファイルを見つけました: {alt_path}")
-                app_file = alt_path
-                app_dir = os.path.dirname(alt_path)
-                break
+        alt_path = _first_existing(ALT_APP_PATHS)
+        if alt_path:
+            logger.info("代替アプリケーションファイルを見つけました: %s", alt_path)
+            app_file = alt_path
+            app_dir = os.path.dirname(alt_path)
         else:
             logger.error("アプリケーションファイルが見つかりません。終了します。")
             return False
     
     # ポート設定
     port = os.environ.get("WEBSITES_PORT", "8181")
-    logger.info(f"ポート設定: {port}")
+    logger.info("ポート設定: %s", port)
     
     # アプリケーション起動
     try:
         os.chdir(app_dir)
-        logger.info(f"アプリケーションディレクトリに移動: {app_dir}")
+        logger.info("アプリケーションディレクトリに移動: %s", app_dir)
         
         cmd = [
             "gunicorn", "app:app", 
-            "--workers", "2", 
+            "--workers", str(get_worker_count()), 
             "--worker-class", "uvicorn.workers.UvicornWorker", 
             "--bind", f"0.0.0.0:{port}", 
-            "--timeout", "120"
+            "--timeout", "120",
+            "--graceful-timeout", "30",
+            # ワーカーのハートビートファイルはメモリ上（tmpfs）に置く
+            "--worker-tmp-dir", "/dev/shm" if os.path.ismount("/dev/shm") else "/tmp",
+            # アプリケーションをマスタープロセスで1回だけ読み込み、ワーカーはforkで共有する
+            "--preload"
         ]
         
-        logger.info(f"実行コマンド: {' '.join(cmd)}")
-        subprocess.run(cmd, check=True)
-        return True
-    except subprocess.CalledProcessError as e:
-        logger.error(f"アプリケーション起動に失敗しました: {e}")
+        logger.info("実行コマンド: %s", ' '.join(cmd))
+        # startup.pyのプロセスをgunicornに置き換える（親プロセスとして残らない）
+        try:
+            os.execvp(cmd[0], cmd)
+        except OSError as e:
+            logger.warning("gunicornを起動できないため、uvicornで起動します: %s", e)
+            fallback_cmd = [
+                sys.executable, "-m", "uvicorn", "app:app",
+                "--host", "0.0.0.0",
+                "--port", port
+            ]
+            logger.info("実行コマンド: %s", ' '.join(fallback_cmd))
+            os.execvp(fallback_cmd[0], fallback_cmd)
+    except OSError as e:
+        logger.error("アプリケーション起動に失敗しました: %s", e)
         return False
 
+def wait_for_diagnosis(diag_process):
+    """バックグラウンドで実行中の診断スクリプトの終了を待つ関数"""
+    try:
+        diag_process.wait(timeout=DIAGNOSIS_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        logger.warning("診断スクリプトが%s秒以内に終了しなかったため停止します", DIAGNOSIS_TIMEOUT)
+        diag_process.kill()
+        diag_process.wait()
+
 if __name__ == "__main__":
     try:
-        # 診断用スクリプトの実行
-        subprocess.run([sys.executable, "diagnosis.py"], check=False)
+        # 診断用スクリプトは DIAG=1 の場合のみ、他の起動処理と並行して実行
+        # （トラブルシューティング時にAzureのアプリ設定で DIAG=1 を設定する）
+        diag_process = None
+        if os.environ.get("DIAG") == "1":
+            diag_process = subprocess.Popen([sys.executable, "diagnosis.py"])
         
         # システムライブラリの確認を追加
         check_system_libraries()
@@ -206,8 +461,12 @@ if __name__ == "__main__":
         # 依存パッケージのインストール
         install_dependencies(req_file)
         
+        # 診断スクリプトの終了を待つ
+        if diag_process is not None:
+            wait_for_diagnosis(diag_process)
+        
         # アプリケーション起動
         start_application(app_dir)
     except Exception as e:
-        logger.error(f"予期しないエラーが発生しました: {e}")
+        logger.error("予期しないエラーが発生しました: %s", e)
         sys.exit(1)